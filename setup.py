@@ -28,6 +28,9 @@ here = os.path.abspath(os.path.dirname(__file__))
 with open(os.path.join(here, "requirements.txt")) as requirements_txt:
     REQUIRES = requirements_txt.read().splitlines()
 
+# Only needed to build filesystem images with --config-template
+EXTRAS_REQUIRE = {"fsimage": ["littlefs-python>=0.6.2"]}
+
 with open(os.path.join(here, "README.md")) as readme:
     LONG_DESCRIPTION = readme.read()
 
@@ -47,6 +50,7 @@ setup(
     test_suite="tests",
     python_requires=">=3.5,<4.0",
     install_requires=REQUIRES,
+    extras_require=EXTRAS_REQUIRE,
     long_description=LONG_DESCRIPTION,
     long_description_content_type="text/markdown",
     keywords=["wled", "lighting", "firmware"],
@@ -0,0 +1,42 @@
+import os
+import struct
+
+import pytest
+
+try:
+    import pytest_benchmark  # noqa: F401 pylint: disable=unused-import
+except ImportError:
+    # Without pytest-benchmark only the unit tests run
+    collect_ignore_glob = ["test_*.py"]
+
+
+def make_image(path, size, flash_mode=2, size_freq=0x20, entry=0x40100000):
+    """Write an app image with a valid ESP header followed by filler."""
+    header = struct.pack("<BBBBI", 0xE9, 1, flash_mode, size_freq, entry)
+    with open(path, "wb") as image:
+        image.write(header)
+        image.write(os.urandom(1024) * ((size - len(header)) // 1024 + 1))
+    return path
+
+
+@pytest.fixture
+def esp8266_firmware(tmp_path):
+    return make_image(str(tmp_path / "firmware_esp8266.bin"), 600 * 1024, size_freq=0x40)
+
+
+@pytest.fixture
+def esp32_files(tmp_path):
+    firmware = make_image(str(tmp_path / "firmware_esp32.bin"), 1200 * 1024, entry=0x40080000)
+    make_image(str(tmp_path / "bootloader_dio_40m.bin"), 16 * 1024, entry=0x40080000)
+    partitions = str(tmp_path / "partitions.bin")
+    with open(partitions, "wb") as partitions_file:
+        partitions_file.write(b"\xff" * 3072)
+    otadata = str(tmp_path / "otadata.bin")
+    with open(otadata, "wb") as otadata_file:
+        otadata_file.write(b"\xff" * 8192)
+    return {
+        "firmware": firmware,
+        "bootloader": str(tmp_path / "bootloader_$FLASH_MODE$_$FLASH_FREQ$.bin"),
+        "partitions": partitions,
+        "otadata": otadata,
+    }
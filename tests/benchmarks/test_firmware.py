@@ -0,0 +1,46 @@
+import pytest
+
+esptool = pytest.importorskip("esptool")
+
+from wledflasher.common import (  # noqa: E402 pylint: disable=wrong-import-position
+    ESP32ChipInfo,
+    ESP8266ChipInfo,
+    configure_write_flash_args,
+    read_firmware_info,
+)
+
+
+def test_read_firmware_info(benchmark, esp8266_firmware):
+    with open(esp8266_firmware, "rb") as firmware:
+        assert benchmark(read_firmware_info, firmware) == ("dio", "40m")
+
+
+def test_configure_write_flash_args_esp8266(benchmark, esp8266_firmware):
+    info = ESP8266ChipInfo("ESP8266EX", "AA:BB:CC:DD:EE:FF", 0x00ABCDEF)
+
+    def configure():
+        mock_args = configure_write_flash_args(info, esp8266_firmware, "4MB", None, None, None)
+        for _, binary in mock_args.addr_filename:
+            binary.close()
+        return mock_args
+
+    assert [address for address, _ in benchmark(configure).addr_filename] == [0x0]
+
+
+def test_configure_write_flash_args_esp32(benchmark, esp32_files):
+    info = ESP32ChipInfo("ESP32D0WDQ6", "AA:BB:CC:DD:EE:FF", 2, "240MHz", True, False, True)
+
+    def configure():
+        mock_args = configure_write_flash_args(
+            info,
+            esp32_files["firmware"],
+            "4MB",
+            esp32_files["bootloader"],
+            esp32_files["partitions"],
+            esp32_files["otadata"],
+        )
+        for _, binary in mock_args.addr_filename:
+            binary.close()
+        return mock_args
+
+    assert [address for address, _ in benchmark(configure).addr_filename] == [0x1000, 0x8000, 0xE000, 0x10000]
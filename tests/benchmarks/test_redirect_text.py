@@ -0,0 +1,57 @@
+import pytest
+
+wx = pytest.importorskip("wx")
+pytest.importorskip("esptool")
+pytest.importorskip("github")
+
+from wledflasher.gui import COLOR_RE, RedirectText  # noqa: E402 pylint: disable=wrong-import-position
+
+LOG_BURST = (
+    "\033[0;36m[12:00:01]\033[0m Writing at 0x00010000... (10 %)\r"
+    "\033[1;33mWARN\033[0m \033[0;31mheap low\033[0m: 12345 bytes\n"
+    "plain line without any colour codes at all\n"
+) * 1000
+
+
+class StubTextCtrl(object):
+    def __init__(self):
+        self.value = ""
+
+    def GetValue(self):  # pylint: disable=invalid-name
+        return self.value
+
+    def AppendText(self, text):  # pylint: disable=invalid-name
+        self.value += text
+
+    def Remove(self, start, end):  # pylint: disable=invalid-name
+        self.value = self.value[:start] + self.value[end:]
+
+    def SetDefaultStyle(self, attr):  # pylint: disable=invalid-name
+        pass
+
+
+@pytest.fixture(autouse=True)
+def call_directly(monkeypatch):
+    monkeypatch.setattr(wx, "CallAfter", lambda func, *args, **kwargs: func(*args, **kwargs))
+
+
+def test_write(benchmark):
+    def write():
+        ctrl = StubTextCtrl()
+        RedirectText(ctrl).write(LOG_BURST)
+        return ctrl
+
+    assert benchmark(write).value.count("\n") == 2000
+
+
+def test_write_line(benchmark):
+    ctrl = StubTextCtrl()
+    redirect = RedirectText(ctrl)
+
+    def write_line():
+        redirect._line = LOG_BURST  # pylint: disable=protected-access
+        redirect._write_line()  # pylint: disable=protected-access
+
+    benchmark(write_line)
+    plain = COLOR_RE.sub("", LOG_BURST)
+    assert ctrl.value and ctrl.value == plain * (len(ctrl.value) // len(plain))
@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip("serial")
+
+from serial.tools import list_ports  # noqa: E402 pylint: disable=wrong-import-position
+from serial.tools.list_ports_common import ListPortInfo  # noqa: E402 pylint: disable=wrong-import-position
+
+from wledflasher.helpers import list_serial_ports  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def make_ports(count):
+    ports = []
+    for i in range(count):
+        port = ListPortInfo("/dev/ttyUSB{}".format(i))
+        if i % 4 == 0:
+            # Built-in UARTs and Bluetooth ports have no USB ids and are skipped
+            port.description = "ttyS{}".format(i)
+        else:
+            port.vid = 0x10C4
+            port.pid = 0xEA60
+            port.serial_number = "{:08X}".format(i)
+            port.description = "CP2102 USB to UART Bridge Controller - CP2102 USB to UART Bridge Controller"
+            port.hwid = port.usb_info()
+        ports.append(port)
+    return ports
+
+
+def test_list_serial_ports(benchmark, monkeypatch):
+    ports = make_ports(2000)
+    monkeypatch.setattr(list_ports, "comports", lambda: ports)
+
+    result = benchmark(list_serial_ports)
+
+    assert len(result) == 1500
+    assert result[0].desc == "CP2102 USB to UART Bridge Controller"
+    assert result[0].vid == 0x10C4
@@ -0,0 +1,39 @@
+import contextlib
+import io
+
+import pytest
+
+serial = pytest.importorskip("serial")
+pytest.importorskip("esptool")
+
+from wledflasher.__main__ import show_logs  # noqa: E402 pylint: disable=wrong-import-position
+
+LOG_LINE = b"\x1b[0;32mWS req:/json/state, 200 OK, heap 23456\x1b[0m\r\n"
+
+
+class DrainingLoopback(type(serial.serial_for_url("loop://", do_not_open=True))):
+    """loop:// port that reports a closed port once everything written to it has been read."""
+
+    def readline(self, size=-1):
+        line = super().readline(size)
+        if not line:
+            raise serial.SerialException("drained")
+        return line
+
+
+def test_show_logs(benchmark):
+    def setup():
+        data = LOG_LINE * 2000
+        port = DrainingLoopback(timeout=0)
+        # The default 4 KiB loopback queue would block the write below
+        port.buffer_size = len(data)
+        port.port = "loop://"
+        port.open()
+        port.write(data)
+        return (port,), {}
+
+    def run(port):
+        with contextlib.redirect_stdout(io.StringIO()):
+            show_logs(port)
+
+    benchmark.pedantic(run, setup=setup, rounds=10)
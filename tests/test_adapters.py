@@ -0,0 +1,36 @@
+import json
+
+from wledflasher.adapters import AdapterIndex
+
+
+def test_missing_index(tmp_path):
+    index = AdapterIndex.load(str(tmp_path / "adapters.json"))
+    assert index.get("1A86:7523:/dev/ttyUSB0", "family") is None
+
+
+def test_corrupt_index(tmp_path):
+    path = tmp_path / "adapters.json"
+    path.write_text("{not json")
+    assert AdapterIndex.load(str(path)).get("1A86:7523:/dev/ttyUSB0", "family") is None
+
+    path.write_text('["not", "a", "dict"]')
+    index = AdapterIndex.load(str(path))
+    assert index.get("1A86:7523:/dev/ttyUSB0", "family") is None
+    index.set("1A86:7523:/dev/ttyUSB0", "family", "ESP32")
+    index.save()
+    assert json.loads(path.read_text()) == {"1A86:7523:/dev/ttyUSB0": {"family": "ESP32"}}
+
+
+def test_set_save_round_trip(tmp_path):
+    path = str(tmp_path / "cache" / "adapters.json")
+    index = AdapterIndex.load(path)
+    index.set("1A86:7523:/dev/ttyUSB0", "family", "ESP8266")
+    index.set("1A86:7523:/dev/ttyUSB0", "mac", "AA:BB:CC:DD:EE:FF")
+    index.set(None, "family", "ESP32")
+    index.save()
+
+    loaded = AdapterIndex.load(path)
+    assert loaded.get("1A86:7523:/dev/ttyUSB0", "family") == "ESP8266"
+    assert loaded.get("1A86:7523:/dev/ttyUSB0", "mac") == "AA:BB:CC:DD:EE:FF"
+    assert loaded.get(None, "family") is None
+    assert not (tmp_path / "cache" / "adapters.json.tmp").exists()
@@ -0,0 +1,218 @@
+import io
+import struct
+
+import pytest
+
+esptool = pytest.importorskip("esptool")
+
+from wledflasher import common  # noqa: E402 pylint: disable=wrong-import-position
+from wledflasher.adapters import AdapterIndex  # noqa: E402
+from wledflasher.common import ESP32ChipInfo, ESP8266ChipInfo, MockEsptoolArgs, WledFlasherError  # noqa: E402
+from wledflasher.const import ERASE_FULL, ERASE_REGIONS, ERASE_REGIONS_FILESYSTEM  # noqa: E402
+
+ADAPTER_KEY = "1A86:7523:/dev/ttyUSB0"
+SECTOR = 0x1000
+ESP8266 = ESP8266ChipInfo("ESP8266EX", "AA:BB:CC:DD:EE:FF", 1)
+ESP32 = ESP32ChipInfo("ESP32D0WDQ6", "AA:BB:CC:DD:EE:FF", 2, "240MHz", True, False, True)
+# arduino-esp32 tools/partitions/default.csv: (type, subtype, offset, size, label)
+DEFAULT_PARTITIONS = [
+    (0x01, 0x02, 0x9000, 0x5000, "nvs"),
+    (0x01, 0x00, 0xE000, 0x2000, "otadata"),
+    (0x00, 0x10, 0x10000, 0x140000, "app0"),
+    (0x00, 0x11, 0x150000, 0x140000, "app1"),
+    (0x01, 0x82, 0x290000, 0x170000, "spiffs"),
+]
+
+
+def partition_table(partitions):
+    data = b"".join(
+        struct.pack("<2sBBII16sI", b"\xaa\x50", type_, subtype, offset, size, label.encode(), 0)
+        for type_, subtype, offset, size, label in partitions
+    )
+    # MD5 entry and erased flash after the table
+    data += b"\xeb\xeb" + b"\xff" * 14 + bytes(16)
+    return io.BytesIO(data + b"\xff" * (0xC00 - len(data)))
+
+
+def esp8266_args(flash_size, firmware_size):
+    return MockEsptoolArgs(flash_size, [(0x0, io.BytesIO(bytes(firmware_size)))], "dio", "40m")
+
+
+def esp32_args(partitions=DEFAULT_PARTITIONS):
+    addr_filename = [
+        (0x1000, io.BytesIO(bytes(0x4A10))),
+        (0x8000, partition_table(partitions)),
+        (0xE000, io.BytesIO(bytes(0x2000))),
+        (0x10000, io.BytesIO(bytes(0xE5A31))),
+    ]
+    return MockEsptoolArgs("4MB", addr_filename, "dio", "40m")
+
+
+class FakePort(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeROM(object):
+    """Chip class whose connect() and date register are set by the test."""
+
+    CHIP_NAME = "ESP8266"
+    DATE_REG_VALUE = 0x00062000
+    date_reg = DATE_REG_VALUE
+    connect_error = None
+    instances = []
+
+    def __init__(self, port):
+        self._port = FakePort()
+        self.connects = 0
+        self.instances.append(self)
+
+    def connect(self):
+        self.connects += 1
+        if self.connect_error is not None:
+            raise esptool.FatalError(self.connect_error)
+
+    def read_reg(self, address):
+        return self.date_reg
+
+
+class DetectedROM(FakeROM):
+    CHIP_NAME = "ESP32"
+
+
+@pytest.fixture
+def known_chip(monkeypatch, tmp_path):
+    """An adapter index saying an ESP8266 was behind the adapter, and a recording ESPLoader.detect_chip."""
+    path = str(tmp_path / "adapters.json")
+    index = AdapterIndex(path)
+    index.set(ADAPTER_KEY, "family", "ESP8266")
+    index.save()
+    load = AdapterIndex.load
+    monkeypatch.setattr(AdapterIndex, "load", classmethod(lambda cls, path=path: load(path)))
+    monkeypatch.setattr(common, "adapter_key", lambda port: ADAPTER_KEY)
+    monkeypatch.setattr(common, "CHIP_CLASSES", {"ESP8266": FakeROM, "ESP32": DetectedROM})
+    monkeypatch.setattr(common.serial, "serial_for_url", lambda port: FakePort())
+    monkeypatch.setattr(FakeROM, "instances", [])
+    detected = []
+
+    def detect_chip(port):
+        detected.append(port)
+        return DetectedROM(port)
+
+    monkeypatch.setattr(esptool.ESPLoader, "detect_chip", staticmethod(detect_chip))
+    return path, detected
+
+
+def test_detect_known_chip(known_chip):
+    _, detected = known_chip
+    chip = common.detect_chip("/dev/ttyUSB0")
+
+    assert isinstance(chip, FakeROM) and not isinstance(chip, DetectedROM)
+    assert chip.connects == 1
+    assert detected == []
+
+
+def test_detect_changed_chip(known_chip, monkeypatch):
+    path, detected = known_chip
+    monkeypatch.setattr(FakeROM, "date_reg", 0x15122500)
+
+    chip = common.detect_chip("/dev/ttyUSB0")
+
+    assert isinstance(chip, DetectedROM)
+    assert FakeROM.instances[0]._port.closed  # pylint: disable=protected-access
+    assert len(detected) == 1
+    assert AdapterIndex.load(path).get(ADAPTER_KEY, "family") == "ESP32"
+
+
+def test_detect_known_chip_connect_error(known_chip, monkeypatch):
+    path, detected = known_chip
+    monkeypatch.setattr(FakeROM, "connect_error", "Failed to connect to ESP8266: Timed out")
+
+    with pytest.raises(WledFlasherError, match="Timed out"):
+        common.detect_chip("/dev/ttyUSB0")
+
+    assert FakeROM.instances[0]._port.closed  # pylint: disable=protected-access
+    assert detected == []
+    assert AdapterIndex.load(path).get(ADAPTER_KEY, "family") == "ESP8266"
+
+
+@pytest.mark.parametrize(
+    "offset, size, expected",
+    [
+        (0x0, 0x1000, (0x0, 0x1000)),
+        (0x1000, 0x10, (0x1000, 0x1000)),
+        (0x1001, 0x10, (0x1000, 0x1000)),
+        (0xFFF, 0x2, (0x0, 0x2000)),
+        (0x10000, 0xE5A31, (0x10000, 0xE6000)),
+        (0x2000, 0x0, (0x2000, 0x0)),
+    ],
+)
+def test_align_region(offset, size, expected):
+    assert common.align_region(offset, size) == expected
+
+
+def test_merge_regions():
+    assert common.merge_regions([]) == []
+    # Disjoint regions stay apart, in address order
+    assert common.merge_regions([(0x8000, 0x1000), (0x1000, 0x1000)]) == [(0x1000, 0x1000), (0x8000, 0x1000)]
+    # Adjacent regions merge
+    assert common.merge_regions([(0x1000, 0x1000), (0x2000, 0x1000)]) == [(0x1000, 0x2000)]
+    # Overlapping regions merge
+    assert common.merge_regions([(0x1000, 0x3000), (0x2000, 0x3000)]) == [(0x1000, 0x4000)]
+    # A region inside another one does not shrink it
+    assert common.merge_regions([(0x1000, 0x8000), (0x2000, 0x1000), (0xA000, 0x1000)]) == [
+        (0x1000, 0x8000),
+        (0xA000, 0x1000),
+    ]
+
+
+def test_read_partition_table():
+    partitions = partition_table(DEFAULT_PARTITIONS)
+    assert common.read_partition_table(partitions) == DEFAULT_PARTITIONS
+    assert partitions.tell() == 0
+    assert common.read_partition_table(io.BytesIO(b"\xff" * 0xC00)) == []
+
+
+def test_filesystem_region():
+    assert common.filesystem_region(ESP32, "4MB", esp32_args()) == (0x290000, 0x170000)
+    assert common.filesystem_region(ESP32, "4MB", esp32_args(DEFAULT_PARTITIONS[:4])) is None
+    assert common.filesystem_region(ESP32, "4MB", MockEsptoolArgs("4MB", [], "dio", "40m")) is None
+    assert common.filesystem_region(ESP8266, "1MB", esp8266_args("1MB", 0x1000)) == (0xDB000, 0x20000)
+    assert common.filesystem_region(ESP8266, "4MB", esp8266_args("4MB", 0x1000)) == (0x300000, 0xFA000)
+    # No WLED layout for this flash size
+    assert common.filesystem_region(ESP8266, "8MB", esp8266_args("8MB", 0x1000)) is None
+
+
+def test_plan_erase_regions_esp8266():
+    mock_args = esp8266_args("4MB", 0x8A2F1)
+    assert common.plan_erase_regions(ERASE_FULL, ESP8266, "4MB", mock_args) is None
+    assert common.plan_erase_regions(ERASE_REGIONS, ESP8266, "4MB", mock_args) == [(0x0, 0x8B000)]
+    assert common.plan_erase_regions(ERASE_REGIONS_FILESYSTEM, ESP8266, "4MB", mock_args) == [
+        (0x0, 0x8B000),
+        (0x300000, 0xFA000),
+    ]
+    # The 1MB firmware runs right up to the filesystem, the two merge
+    mock_args = esp8266_args("1MB", 0xDA001)
+    assert common.plan_erase_regions(ERASE_REGIONS_FILESYSTEM, ESP8266, "1MB", mock_args) == [(0x0, 0xFB000)]
+
+
+def test_plan_erase_regions_unknown_flash_size():
+    mock_args = esp8266_args("8MB", 0x8A2F1)
+    assert common.plan_erase_regions(ERASE_REGIONS, ESP8266, "8MB", mock_args) == [(0x0, 0x8B000)]
+    with pytest.raises(WledFlasherError):
+        common.plan_erase_regions(ERASE_REGIONS_FILESYSTEM, ESP8266, "8MB", mock_args)
+
+
+def test_plan_erase_regions_esp32():
+    mock_args = esp32_args()
+    # otadata ends where the app starts
+    regions = [(0x1000, 0x5000), (0x8000, 0x1000), (0xE000, 0xE8000)]
+    assert common.plan_erase_regions(ERASE_REGIONS, ESP32, "4MB", mock_args) == regions
+    assert common.plan_erase_regions(ERASE_REGIONS_FILESYSTEM, ESP32, "4MB", mock_args) == regions + [
+        (0x290000, 0x170000)
+    ]
+    for _, binary in mock_args.addr_filename:
+        assert binary.tell() == 0
@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import re
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("esptool")
+pytest.importorskip("requests")
+
+from wledflasher import download  # noqa: E402 pylint: disable=wrong-import-position
+from wledflasher.common import WledFlasherError  # noqa: E402
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+# Per connection speed of the slow paths
+SLOW_RATE = 1024 * 1024
+WRITE_SIZE = 64 * 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves DATA, the first path segment says how: ok, broken, norange, slow, slow-norange, gzip or gzip-norange.
+
+    The gzip kinds compress the body unless the client asks for the identity encoding, gzip-norange always does.
+    """
+
+    requests = []
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.requests.append((self.path, self.headers.get("Range")))
+        kind = self.path.split("/")[1]
+        if kind == "broken":
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = DATA
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+        if match is not None and not kind.endswith("norange"):
+            first, last = int(match.group(1)), int(match.group(2))
+            body = DATA[first : last + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(first, last, len(DATA)))
+        else:
+            self.send_response(200)
+        if kind.startswith("gzip") and (kind == "gzip-norange" or self.headers.get("Accept-Encoding") != "identity"):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        for pos in range(0, len(body), WRITE_SIZE):
+            if kind.startswith("slow"):
+                time.sleep(WRITE_SIZE / SLOW_RATE)
+            self.wfile.write(body[pos : pos + WRITE_SIZE])
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_port)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def requests_log():
+    del RangeHandler.requests[:]
+    return RangeHandler.requests
+
+
+def test_mirror_urls():
+    assert download.mirror_urls("https://github.com/a/b.bin", ["https://mirror/", "http://other"]) == [
+        "https://github.com/a/b.bin",
+        "https://mirror/a/b.bin",
+        "http://other/a/b.bin",
+    ]
+
+
+def test_ranged_download(server, requests_log):
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    with download.download_binary(server + "/ok/wled.bin#sha256=" + sha256, mirrors=[]) as output:
+        assert output.read() == DATA
+    ranges = [header for _, header in requests_log]
+    assert ranges[0] == "bytes=0-0"
+    assert len(ranges) == 1 + download.DOWNLOAD_CONNECTIONS
+
+
+def test_download_without_range_support(server, requests_log):
+    with download.download_binary(server + "/norange/wled.bin", mirrors=[]) as output:
+        assert output.read() == DATA
+    assert len(requests_log) == 1
+
+
+def test_download_from_compressing_server(server):
+    with download.download_binary(server + "/gzip/wled.bin", mirrors=[]) as output:
+        assert output.read() == DATA
+    with download.download_binary(server + "/gzip-norange/wled.bin", mirrors=[]) as output:
+        assert output.read() == DATA
+
+
+def test_mirror_fallback(server, requests_log):
+    with download.download_binary(server + "/broken/wled.bin", mirrors=[server + "/ok"]) as output:
+        assert output.read() == DATA
+    assert requests_log[0][0] == "/broken/wled.bin"
+    assert requests_log[1][0] == "/ok/broken/wled.bin"
+
+
+def test_sha256_mismatch(server):
+    with pytest.raises(WledFlasherError, match="SHA-256 does not match"):
+        download.download_binary(server + "/ok/wled.bin", expected_sha256="0" * 64, mirrors=[])
+
+
+@pytest.fixture
+def slow_limits(monkeypatch):
+    # Between the speed of one connection and that of all of them together
+    monkeypatch.setattr(download, "MIN_DOWNLOAD_RATE", 2 * SLOW_RATE)
+    monkeypatch.setattr(download, "SLOW_GRACE_PERIOD", 0.3)
+
+
+@pytest.mark.usefixtures("slow_limits")
+def test_rate_counts_all_connections(server, requests_log):
+    with download.download_binary(server + "/slow/wled.bin", mirrors=[server + "/ok"]) as output:
+        assert output.read() == DATA
+    assert all(path == "/slow/wled.bin" for path, _ in requests_log)
+
+
+@pytest.mark.usefixtures("slow_limits")
+def test_slow_download_tries_mirror(server, requests_log):
+    with download.download_binary(server + "/slow-norange/wled.bin", mirrors=[server + "/ok"]) as output:
+        assert output.read() == DATA
+    assert requests_log[-1][0] == "/ok/slow-norange/wled.bin"
+
+
+@pytest.mark.usefixtures("slow_limits")
+def test_slow_download_without_mirror_completes(server):
+    with download.download_binary(server + "/slow-norange/wled.bin", mirrors=[]) as output:
+        assert output.read() == DATA
@@ -0,0 +1,195 @@
+import hashlib
+import io
+import os
+import zlib
+
+import pytest
+
+esptool = pytest.importorskip("esptool")
+
+from wledflasher import flash  # noqa: E402 pylint: disable=wrong-import-position
+from wledflasher.common import MockEsptoolArgs, WledFlasherError  # noqa: E402
+from wledflasher.flash import WRITE_CHUNK_SIZE, FlashCheckpoint  # noqa: E402
+
+APP_ADDRESS = 0x10000
+
+
+class FakePort(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeStub(object):
+    """Stub loader writing into an in-memory flash, optionally failing after a number of blocks."""
+
+    FLASH_WRITE_SIZE = 0x4000
+    BOOTLOADER_FLASH_OFFSET = 0x1000
+
+    def __init__(self, memory, fail_after=None):
+        self.memory = memory
+        self.fail_after = fail_after
+        self.written = []
+        self.begins = []
+        self._port = FakePort()
+        self._write = None
+
+    def flash_defl_begin(self, size, compsize, offset):
+        # Like esptool's
+        print("Compressed {} bytes to {}...".format(size, compsize))
+        self.begins.append((offset, size))
+        self._write = [offset, zlib.decompressobj()]
+
+    def flash_defl_block(self, data, seq, timeout):
+        if self.fail_after is not None:
+            if self.fail_after == 0:
+                raise esptool.FatalError("Timed out waiting for packet header")
+            self.fail_after -= 1
+        data = self._write[1].decompress(data)
+        offset = self._write[0]
+        self.memory[offset : offset + len(data)] = data
+        self._write[0] += len(data)
+        self.written.append((offset, len(data)))
+
+    def flash_md5sum(self, address, size):
+        return hashlib.md5(bytes(self.memory[address : address + size])).hexdigest()
+
+    def flash_begin(self, size, offset):
+        pass
+
+    def flash_defl_finish(self, reboot):
+        pass
+
+
+def make_args(image, flash_size="4MB"):
+    return MockEsptoolArgs(flash_size, [(APP_ADDRESS, io.BytesIO(image))], "dio", "40m")
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(flash, "RETRY_DELAY", 0)
+
+
+def test_resume_offset():
+    checkpoint = FlashCheckpoint()
+    assert checkpoint.resume_offset(APP_ADDRESS) == 0
+    checkpoint.confirm(APP_ADDRESS, "a")
+    checkpoint.confirm(APP_ADDRESS, "b")
+    assert checkpoint.resume_offset(APP_ADDRESS) == 2 * WRITE_CHUNK_SIZE
+    assert checkpoint.resume_offset(0x1000) == 0
+
+
+def test_verify_checkpoint_drops_chunks_no_longer_in_flash():
+    image = os.urandom(3 * WRITE_CHUNK_SIZE)
+    memory = bytearray(APP_ADDRESS + len(image))
+    memory[APP_ADDRESS : APP_ADDRESS + len(image)] = image
+    checkpoint = FlashCheckpoint()
+    for offset in range(0, len(image), WRITE_CHUNK_SIZE):
+        checkpoint.confirm(APP_ADDRESS, hashlib.md5(image[offset : offset + WRITE_CHUNK_SIZE]).hexdigest())
+
+    stub = FakeStub(memory)
+    flash.verify_checkpoint(stub, [(APP_ADDRESS, image)], checkpoint)
+    assert checkpoint.resume_offset(APP_ADDRESS) == 3 * WRITE_CHUNK_SIZE
+
+    # The last chunk was only partly written before the board dropped off
+    memory[APP_ADDRESS + 2 * WRITE_CHUNK_SIZE + 10] ^= 0xFF
+    flash.verify_checkpoint(stub, [(APP_ADDRESS, image)], checkpoint)
+    assert checkpoint.resume_offset(APP_ADDRESS) == 2 * WRITE_CHUNK_SIZE
+
+
+def test_write_flash_resumable_resumes_after_failure(capsys):
+    image = os.urandom(4 * WRITE_CHUNK_SIZE + 0x800)
+    memory = bytearray(APP_ADDRESS + len(image))
+    # Each 64 KiB chunk of random data compresses to five blocks, fail in the middle of the third chunk
+    first = FakeStub(memory, fail_after=12)
+    stubs = []
+
+    def reconnect():
+        stubs.append(FakeStub(memory))
+        return stubs[-1]
+
+    finished = flash.write_flash_resumable(first, make_args(image), reconnect, retries=2)
+    assert "Compressed" not in capsys.readouterr().out
+
+    assert finished is stubs[0]
+    assert first._port.closed  # pylint: disable=protected-access
+    assert bytes(memory[APP_ADDRESS:]) == image
+    # The two confirmed chunks were not written again
+    assert min(offset for offset, _ in finished.written) == APP_ADDRESS + 2 * WRITE_CHUNK_SIZE
+
+
+def test_write_flash_resumable_gives_up_after_retries():
+    image = os.urandom(2 * WRITE_CHUNK_SIZE)
+    memory = bytearray(APP_ADDRESS + len(image))
+
+    def reconnect():
+        return FakeStub(memory, fail_after=0)
+
+    with pytest.raises(WledFlasherError):
+        flash.write_flash_resumable(FakeStub(memory, fail_after=0), make_args(image), reconnect, retries=2)
+
+
+def test_write_flash_resumable_refuses_image_past_end_of_flash():
+    image = os.urandom(0x100000 - APP_ADDRESS + 4)
+    stub = FakeStub(bytearray(0x100000))
+
+    def reconnect():
+        raise AssertionError("an image that does not fit is not retried")
+
+    with pytest.raises(WledFlasherError, match="will not fit in 1048576 bytes of flash"):
+        flash.write_flash_resumable(stub, make_args(image, "1MB"), reconnect)
+    assert stub.begins == []
+
+    # Exactly up to the end of flash is fine
+    flash.write_flash_resumable(stub, make_args(image[:-4], "1MB"), reconnect)
+    assert bytes(stub.memory[APP_ADDRESS:]) == image[:-4]
+
+
+def test_changed_regions():
+    block = esptool.ESPLoader.FLASH_SECTOR_SIZE
+    old = bytes(8 * block)
+    new = bytearray(old)
+    new[block + 1] = 1
+    new[2 * block] = 1
+    new[5 * block + 7] = 1
+    new += b"\x01" * 100
+
+    assert flash.changed_regions(old, old) == []
+    assert flash.changed_regions(old, bytes(new)) == [(block, 2 * block), (5 * block, block), (8 * block, 100)]
+    assert flash.changed_regions(b"", old[: 2 * block]) == [(0, 2 * block)]
+
+
+def test_write_changed_blocks(capsys):
+    block = esptool.ESPLoader.FLASH_SECTOR_SIZE
+    old_image = os.urandom(2 * WRITE_CHUNK_SIZE + 4 * block)
+    new_image = bytearray(old_image)
+    new_image[3 * block] ^= 0xFF
+    new_image[WRITE_CHUNK_SIZE - block : WRITE_CHUNK_SIZE + block] = os.urandom(2 * block)
+    # A changed run longer than WRITE_CHUNK_SIZE is written in several chunks
+    new_image[-2 * block - WRITE_CHUNK_SIZE :] = os.urandom(2 * block + WRITE_CHUNK_SIZE)
+    new_image = bytes(new_image)
+    memory = bytearray(APP_ADDRESS + len(old_image))
+    memory[APP_ADDRESS:] = old_image
+    stub = FakeStub(memory)
+
+    written = flash.write_changed_blocks(stub, [(APP_ADDRESS, new_image)], [(APP_ADDRESS, old_image)])
+    assert "Compressed" not in capsys.readouterr().out
+
+    assert written == 5 * block + WRITE_CHUNK_SIZE
+    assert bytes(memory[APP_ADDRESS:]) == new_image
+    tail = APP_ADDRESS + len(new_image) - 2 * block - WRITE_CHUNK_SIZE
+    assert stub.begins == [
+        (APP_ADDRESS + 3 * block, block),
+        (APP_ADDRESS + WRITE_CHUNK_SIZE - block, 2 * block),
+        (tail, WRITE_CHUNK_SIZE),
+        (tail + WRITE_CHUNK_SIZE, 2 * block),
+    ]
+
+
+def test_write_changed_blocks_fails_cleanly():
+    image = os.urandom(2 * esptool.ESPLoader.FLASH_SECTOR_SIZE)
+    stub = FakeStub(bytearray(APP_ADDRESS + len(image)), fail_after=0)
+    with pytest.raises(WledFlasherError):
+        flash.write_changed_blocks(stub, [(APP_ADDRESS, image)], [])
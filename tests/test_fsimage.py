@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+littlefs = pytest.importorskip("littlefs")
+pytest.importorskip("esptool")
+
+from wledflasher import fsimage  # noqa: E402 pylint: disable=wrong-import-position
+from wledflasher.common import ESP32ChipInfo, ESP8266ChipInfo, WledFlasherError  # noqa: E402
+from wledflasher.const import ESP32_LITTLEFS_CONFIG, ESP8266_LITTLEFS_CONFIG, LITTLEFS_DISK_VERSION  # noqa: E402
+
+MAC = "AA:BB:CC:DD:EE:FF"
+ESP8266 = ESP8266ChipInfo("ESP8266EX", MAC, 1)
+ESP32 = ESP32ChipInfo("ESP32D0WDQ6", MAC, 2, "240MHz", True, False, True)
+TEMPLATE = '{"id": {"name": "${hostname}", "mac": "${mac}"}, "nw": {"ins": [{"ssid": "${ssid}"}]}}'
+
+
+@pytest.fixture
+def template(tmp_path, monkeypatch):
+    monkeypatch.setattr(fsimage, "FS_IMAGE_CACHE_DIR", str(tmp_path / "cache"))
+    path = tmp_path / "cfg.json.template"
+    path.write_text(TEMPLATE)
+    return str(path)
+
+
+def mount_like_device(image, config, block_size, fs_size):
+    """Mount the image the way the chip does, with its LittleFS settings."""
+    config = dict(config, block_size=block_size)
+    fs = littlefs.LittleFS(mount=False, disk_version=LITTLEFS_DISK_VERSION, block_count=fs_size // block_size, **config)
+    fs.context.buffer[:] = image
+    fs.mount()
+    return fs
+
+
+@pytest.mark.parametrize(
+    "info, flash_size, config, block_size, fs_size",
+    [
+        # _FS_block of eagle.flash.1m128.ld, eagle.flash.2m512.ld and eagle.flash.4m1m.ld
+        (ESP8266, "1MB", ESP8266_LITTLEFS_CONFIG, 0x1000, 0x20000),
+        (ESP8266, "2MB", ESP8266_LITTLEFS_CONFIG, 0x2000, 0x7A000),
+        (ESP8266, "4MB", ESP8266_LITTLEFS_CONFIG, 0x2000, 0xFA000),
+        (ESP32, "4MB", ESP32_LITTLEFS_CONFIG, 0x1000, 0x40000),
+    ],
+)
+def test_build_filesystem_image_mounts_with_device_config(
+    tmp_path, template, info, flash_size, config, block_size, fs_size
+):
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    (static_dir / "presets.json").write_text('{"0": {}}')
+
+    for _ in range(2):  # Built once, then from the cached base image
+        image = fsimage.build_filesystem_image(
+            info, flash_size, fs_size, template, {"ssid": "home"}, str(static_dir)
+        ).read()
+        assert len(image) == fs_size
+
+        fs = mount_like_device(image, config, block_size, fs_size)
+        stat = fs.fs_stat()
+        assert stat.disk_version == LITTLEFS_DISK_VERSION
+        assert stat.name_max == config["name_max"]
+        assert sorted(fs.listdir("/")) == ["cfg.json", "presets.json"]
+        with fs.open("cfg.json", "r") as config_file:
+            cfg = json.loads(config_file.read())
+        assert cfg["id"] == {"name": "wled-ddeeff", "mac": MAC}
+        assert cfg["nw"]["ins"][0]["ssid"] == "home"
+
+
+def test_render_config_errors(tmp_path, template):
+    with pytest.raises(WledFlasherError):
+        fsimage.render_config(template, {"hostname": "wled", "mac": MAC})
+    with pytest.raises(WledFlasherError):
+        fsimage.render_config(str(tmp_path / "missing.json"), {})
+
+    broken = tmp_path / "broken.json"
+    broken.write_text('{"name": ${hostname}}')
+    with pytest.raises(WledFlasherError):
+        fsimage.render_config(str(broken), {"hostname": "wled"})
+
+
+def test_render_config_escapes_values(template):
+    values = {"hostname": 'my "wled"', "mac": MAC, "ssid": "pa\\ss\nword\u00e9"}
+    config = json.loads(fsimage.render_config(template, values).decode("utf-8"))
+    assert config["id"]["name"] == 'my "wled"'
+    assert config["nw"]["ins"][0]["ssid"] == "pa\\ss\nword\u00e9"
+
+
+def test_unknown_esp8266_layout(template):
+    with pytest.raises(WledFlasherError):
+        fsimage.build_filesystem_image(ESP8266, "8MB", 0x100000, template, {"ssid": "home"})
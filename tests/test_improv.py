@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+import pytest
+
+pty = pytest.importorskip("pty")
+tty = pytest.importorskip("tty")
+serial = pytest.importorskip("serial")
+pytest.importorskip("esptool")
+
+from wledflasher import improv  # noqa: E402 pylint: disable=wrong-import-position
+from wledflasher.improv import ImprovSerial, encode_packet  # noqa: E402
+
+# Log line of a device that has "IMPROV" in it, the byte after the would-be header suggests 100+ more bytes
+NOISE = b"IMPROV serial ready\r\n"
+DEVICE_INFO = [b"WLED", b"0.11.1", b"esp8266", b"WLED-ddeeff"]
+URL = b"http://192.168.1.42"
+
+
+def encode_strings(strings):
+    return b"".join(bytes([len(string)]) + string for string in strings)
+
+
+class FakePort(object):
+    def __init__(self, data):
+        self._data = data
+        self.in_waiting = len(data)
+
+    def read(self, size):
+        data, self._data = self._data[:size], self._data[size:]
+        self.in_waiting = len(self._data)
+        return data
+
+
+class ImprovDevice(object):
+    """Stand-in for a WLED board answering Improv requests on the other end of a pty."""
+
+    def __init__(self, fd, state=improv.STATE_AUTHORIZED):
+        self._fd = fd
+        self.state = state
+        self.credentials = None
+
+    def send(self, data):
+        os.write(self._fd, data)
+
+    def handle(self, command, data):
+        if command == improv.COMMAND_REQUEST_STATE:
+            self.send(NOISE + encode_packet(improv.TYPE_CURRENT_STATE, bytes([self.state])))
+        elif command == improv.COMMAND_REQUEST_INFO:
+            info = encode_strings(DEVICE_INFO)
+            self.send(encode_packet(improv.TYPE_RPC_RESULT, bytes([command, len(info)]) + info))
+        elif command == improv.COMMAND_WIFI_SETTINGS:
+            self.credentials = improv.decode_strings(data)
+            if self.credentials[1] != "secret":
+                self.send(encode_packet(improv.TYPE_ERROR_STATE, bytes([0x03])))
+                return
+            self.send(encode_packet(improv.TYPE_CURRENT_STATE, bytes([improv.STATE_PROVISIONING])))
+            self.send(b"wifi: connected\r\n" + NOISE)
+            self.send(encode_packet(improv.TYPE_CURRENT_STATE, bytes([improv.STATE_PROVISIONED])))
+            urls = encode_strings([URL])
+            self.send(encode_packet(improv.TYPE_RPC_RESULT, bytes([command, len(urls)]) + urls))
+
+    def run(self):
+        self.send(b"WLED booting...\r\n" + NOISE)
+        buffer = b""
+        while True:
+            try:
+                buffer += os.read(self._fd, 256)
+            except OSError:
+                return
+            while True:
+                start = buffer.find(improv.IMPROV_HEADER)
+                if start < 0 or len(buffer) < start + 9 or len(buffer) < start + 10 + buffer[start + 8]:
+                    break
+                buffer = buffer[start:]
+                packet, buffer = buffer[: 10 + buffer[8]], buffer[10 + buffer[8] :]
+                assert packet[7] == improv.TYPE_RPC
+                assert sum(packet[:-1]) & 0xFF == packet[-1]
+                self.handle(packet[9], packet[11:-1])
+
+
+@pytest.fixture
+def device():
+    master, slave = pty.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    stand_in = ImprovDevice(master)
+    thread = threading.Thread(target=stand_in.run)
+    thread.daemon = True
+    thread.start()
+    port = serial.Serial(os.ttyname(slave), 115200)
+    yield stand_in, port
+    port.close()
+    os.close(slave)
+    os.close(master)
+
+
+def test_read_packet_skips_improv_in_log_text():
+    packet = encode_packet(improv.TYPE_CURRENT_STATE, bytes([improv.STATE_AUTHORIZED]))
+    client = ImprovSerial(FakePort(b"boot\r\n" + NOISE + b"IMPROVIMPROV" + packet))
+    start = time.time()
+    assert client.read_packet(start + 2) == (improv.TYPE_CURRENT_STATE, bytes([improv.STATE_AUTHORIZED]))
+    assert time.time() - start < 1
+
+
+def test_read_packet_skips_bad_checksum():
+    good = encode_packet(improv.TYPE_CURRENT_STATE, bytes([improv.STATE_PROVISIONED]))
+    bad = bytearray(encode_packet(improv.TYPE_CURRENT_STATE, bytes([improv.STATE_AUTHORIZED])))
+    bad[-2] ^= 0xFF
+    client = ImprovSerial(FakePort(bytes(bad) + good))
+    assert client.read_packet(time.time() + 2) == (improv.TYPE_CURRENT_STATE, bytes([improv.STATE_PROVISIONED]))
+    assert client.read_packet(time.time() + 0.2) is None
+
+
+def test_provision_wifi(device):
+    stand_in, port = device
+    result = improv.provision_wifi(port, "home", "secret", 5, 5)
+
+    assert stand_in.credentials == ["home", "secret"]
+    assert result.success
+    assert result.ip_address == "192.168.1.42"
+    assert result.urls == [URL.decode()]
+    assert result.device_info == [info.decode() for info in DEVICE_INFO]
+
+
+def test_provision_wifi_error(device):
+    _, port = device
+    result = improv.provision_wifi(port, "home", "wrong", 5, 5)
+
+    assert not result.success
+    assert result.error == "unable to connect"
@@ -0,0 +1,60 @@
+import os
+import re
+
+from wledflasher import logstore
+from wledflasher.logstore import LogStore, normalize_mac
+
+MAC = "AA:BB:CC:DD:EE:FF"
+START = 1600000000.0
+
+
+def make_line(i):
+    return "line {} {}".format(i, "warn" if i % 10 == 0 else "info")
+
+
+def fill(store, count, step=1.0):
+    for i in range(count):
+        store.append(START + i * step, make_line(i))
+
+
+def test_normalize_mac():
+    assert normalize_mac("aa:bb:cc:dd:ee:ff") == "AABBCCDDEEFF"
+    assert normalize_mac("AA-BB-CC-DD-EE-FF") == "AABBCCDDEEFF"
+
+
+def test_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(logstore, "CHUNK_LINES", 25)
+    with LogStore(MAC, str(tmp_path)) as store:
+        fill(store, 110)
+
+    store = LogStore(MAC.lower(), str(tmp_path))
+    assert len(store.read_index()) == 5
+    lines = list(store.query())
+    assert [line for _, line in lines] == [make_line(i) for i in range(110)]
+    assert lines[-1][0] == START + 109
+
+    in_range = list(store.query(START + 30, START + 59.5))
+    assert [timestamp - START for timestamp, _ in in_range] == list(range(30, 60))
+
+    assert [line for _, line in store.query(pattern="warn")] == ["line {} warn".format(i) for i in range(0, 110, 10)]
+    assert [line for _, line in store.query(START + 50, pattern=re.compile(r"^line 9\d "))][0] == "line 90 warn"
+
+
+def test_chunks_split_by_time(tmp_path):
+    store = LogStore(MAC, str(tmp_path))
+    fill(store, 4, step=logstore.CHUNK_SECONDS / 2)
+    store.flush()
+    assert [(first - START, last - START) for first, last, _, _ in store.read_index()] == [
+        (0, logstore.CHUNK_SECONDS),
+        (logstore.CHUNK_SECONDS * 1.5, logstore.CHUNK_SECONDS * 1.5),
+    ]
+
+
+def test_query_without_archive(tmp_path):
+    store = LogStore(MAC, str(tmp_path))
+    assert list(store.query()) == []
+
+    fill(store, 3)
+    store.flush()
+    os.remove(os.path.join(store.path, "chunks.bin"))
+    assert list(store.query()) == []
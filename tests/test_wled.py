@@ -0,0 +1,117 @@
+import struct
+
+import pytest
+
+pytest.importorskip("esptool")
+pytest.importorskip("github")
+
+from wledflasher import wled  # noqa: E402 pylint: disable=wrong-import-position
+from wledflasher.common import ESP32ChipInfo, ESP8266ChipInfo, WledFlasherError  # noqa: E402
+
+ESP8266_ENTRY = 0x40100000
+ESP32_ENTRY = 0x40080000
+
+
+def make_header(size_code, entry):
+    return struct.pack("<BBBBI", 0xE9, 1, 2, size_code << 4, entry)
+
+
+class FakeAsset(object):
+    def __init__(self, asset_id, name):
+        self.id = asset_id
+        self.name = name
+        self.updated_at = "2021-01-01T00:00:00"
+        self.browser_download_url = "https://example.com/{}".format(name)
+
+
+class FakeRelease(object):
+    id = 1234
+    tag_name = "v0.11.1"
+
+    def __init__(self, names):
+        self._assets = [FakeAsset(i, name) for i, name in enumerate(names)]
+
+    def get_assets(self):
+        return self._assets
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("WLED_0.11.1_ESP8266.bin", ("ESP8266", "4MB", "")),
+        ("WLED_0.11.1_ESP01.bin", ("ESP8266", "1MB", "")),
+        ("WLED_0.11.1_ESP02.bin", ("ESP8266", "2MB", "")),
+        ("WLED_0.11.1_ESP32.bin", ("ESP32", "4MB", "")),
+        ("WLED_0.11.1_ESP32_Ethernet.bin", ("ESP32", "4MB", "ethernet")),
+        ("WLED_0.12.0_ESP8266_1MB_compat.bin", ("ESP8266", "1MB", "compat")),
+        ("WLED_0.11.1_unknown.bin", (None, None, "")),
+    ],
+)
+def test_classify_asset_name(name, expected):
+    assert wled.classify_asset_name(name) == expected
+
+
+def test_classify_image_header():
+    assert wled.classify_image_header(make_header(4, ESP8266_ENTRY)) == ("ESP8266", "4MB")
+    assert wled.classify_image_header(make_header(2, ESP8266_ENTRY)) == ("ESP8266", "1MB")
+    assert wled.classify_image_header(make_header(2, ESP32_ENTRY)) == ("ESP32", "4MB")
+    assert wled.classify_image_header(make_header(2, 0x12345678)) == (None, None)
+    assert wled.classify_image_header(b"\x00" * 8) == (None, None)
+    assert wled.classify_image_header(b"\xe9") == (None, None)
+
+
+@pytest.fixture
+def release(monkeypatch, tmp_path):
+    headers = {
+        "WLED_0.11.1_ESP01.bin": make_header(2, ESP8266_ENTRY),
+        "WLED_0.11.1_ESP02.bin": make_header(3, ESP8266_ENTRY),
+        "WLED_0.11.1_ESP8266.bin": make_header(4, ESP8266_ENTRY),
+        "WLED_0.11.1_ESP32.bin": make_header(2, ESP32_ENTRY),
+        "WLED_0.11.1_ESP32_Ethernet.bin": make_header(2, ESP32_ENTRY),
+    }
+    monkeypatch.setattr(wled, "ASSET_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(wled, "read_asset_header", lambda asset: headers[asset.name])
+    return FakeRelease(sorted(headers) + ["WLED_0.11.1_ESP8266.bin.gz"])
+
+
+def test_select_release_asset(release):
+    esp8266 = ESP8266ChipInfo("ESP8266EX", "AA:BB:CC:DD:EE:FF", 1)
+    esp32 = ESP32ChipInfo("ESP32D0WDQ6", "AA:BB:CC:DD:EE:FF", 2, "240MHz", True, False, True)
+
+    assert wled.select_release_asset(release, esp8266, "4MB").name == "WLED_0.11.1_ESP8266.bin"
+    assert wled.select_release_asset(release, esp8266, "2MB").name == "WLED_0.11.1_ESP02.bin"
+    assert wled.select_release_asset(release, esp8266, "1MB").name == "WLED_0.11.1_ESP01.bin"
+    assert wled.select_release_asset(release, esp32, "4MB").name == "WLED_0.11.1_ESP32.bin"
+    assert wled.select_release_asset(release, esp32, "4MB", "ethernet").name == "WLED_0.11.1_ESP32_Ethernet.bin"
+    with pytest.raises(WledFlasherError):
+        wled.select_release_asset(release, esp32, "2MB")
+
+
+def test_select_release_asset_uses_index(release, monkeypatch):
+    esp8266 = ESP8266ChipInfo("ESP8266EX", "AA:BB:CC:DD:EE:FF", 1)
+    wled.select_release_asset(release, esp8266, "4MB")
+
+    def fail(asset):
+        raise AssertionError("header of {} read again".format(asset.name))
+
+    monkeypatch.setattr(wled, "read_asset_header", fail)
+    assert wled.select_release_asset(release, esp8266, "4MB").name == "WLED_0.11.1_ESP8266.bin"
+
+
+def test_select_release_asset_without_headers(release, monkeypatch):
+    esp8266 = ESP8266ChipInfo("ESP8266EX", "AA:BB:CC:DD:EE:FF", 1)
+    read_header = wled.read_asset_header
+
+    def read_header_or_fail(asset):
+        if asset.name == "WLED_0.11.1_ESP8266.bin":
+            raise WledFlasherError("Error while reading header of '{}': timed out".format(asset.name))
+        return read_header(asset)
+
+    monkeypatch.setattr(wled, "read_asset_header", read_header_or_fail)
+    assert wled.select_release_asset(release, esp8266, "4MB").name == "WLED_0.11.1_ESP8266.bin"
+
+    # Only the assets whose header was read are remembered
+    read = []
+    monkeypatch.setattr(wled, "read_asset_header", lambda asset: read.append(asset.name) or read_header(asset))
+    assert wled.select_release_asset(release, esp8266, "4MB").name == "WLED_0.11.1_ESP8266.bin"
+    assert read == ["WLED_0.11.1_ESP8266.bin"]
@@ -2,7 +2,10 @@ from __future__ import print_function
 
 import argparse
 from datetime import datetime
+import os
+import re
 import sys
+import threading
 import time
 
 import esptool
@@ -10,16 +13,57 @@ import serial
 
 from wledflasher import const
 from wledflasher.common import (
+    CHIP_CLASSES,
     ESP32ChipInfo,
     WledFlasherError,
+    check_images_fit,
     chip_run_stub,
     configure_write_flash_args,
     detect_chip,
     detect_flash_size,
+    erase_flash_regions,
+    open_downloadable_binary,
+    plan_erase_regions,
     read_chip_info,
+    read_firmware_info,
 )
-from wledflasher.const import ESP32_DEFAULT_BOOTLOADER_FORMAT, ESP32_DEFAULT_OTA_DATA, ESP32_DEFAULT_PARTITIONS
-from wledflasher.helpers import list_serial_ports
+from wledflasher.const import (
+    ERASE_FULL,
+    ERASE_STRATEGIES,
+    ESP32_APP_OFFSET,
+    ESP32_DEFAULT_BOOTLOADER_FORMAT,
+    ESP32_DEFAULT_OTA_DATA,
+    ESP32_DEFAULT_PARTITIONS,
+    ESP8266_APP_OFFSET,
+)
+from wledflasher.adapters import AdapterIndex
+from wledflasher.flash import prepare_images, write_changed_blocks, write_flash_resumable
+from wledflasher.helpers import adapter_key, list_serial_ports
+from wledflasher.improv import provision_wifi
+from wledflasher.logstore import LogStore
+
+
+def parse_time(value):
+    for time_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(datetime.strptime(value, time_format).timetuple())
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError("invalid time '{}', use YYYY-MM-DD[ HH:MM[:SS]]".format(value))
+
+
+def parse_pattern(value):
+    try:
+        return re.compile(value)
+    except re.error as err:
+        raise argparse.ArgumentTypeError("invalid regular expression '{}': {}".format(value, err))
+
+
+def parse_config_value(value):
+    key, sep, val = value.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError("invalid config value '{}', use KEY=VALUE".format(value))
+    return key, val
 
 
 def parse_args(argv):
@@ -37,10 +81,68 @@ def parse_args(argv):
     parser.add_argument("--partitions", help="(ESP32-only) The partitions to flash.", default=ESP32_DEFAULT_PARTITIONS)
     parser.add_argument("--otadata", help="(ESP32-only) The otadata file to flash.", default=ESP32_DEFAULT_OTA_DATA)
     parser.add_argument("--no-erase", help="Do not erase flash before flashing", action="store_true")
+    parser.add_argument(
+        "--erase",
+        choices=ERASE_STRATEGIES,
+        default=ERASE_FULL,
+        help="What to erase before flashing: the whole chip, only the regions being written, "
+        "or those regions plus the filesystem.",
+    )
+    parser.add_argument(
+        "--config-template",
+        help="Also flash a filesystem with a cfg.json rendered from this template. "
+        "$hostname, $mac and $mac_suffix are filled in per device.",
+    )
+    parser.add_argument(
+        "--config-value",
+        metavar="KEY=VALUE",
+        action="append",
+        default=[],
+        type=parse_config_value,
+        help="(with --config-template) Extra template value, can be given multiple times.",
+    )
+    parser.add_argument("--fs-dir", help="(with --config-template) Directory of extra files to put in the filesystem.")
+    parser.add_argument("--wifi-ssid", help="After flashing, send these Wi-Fi credentials over Improv serial.")
+    parser.add_argument("--wifi-password", help="(with --wifi-ssid) The Wi-Fi password.", default="")
+    parser.add_argument(
+        "--provision-timeout",
+        type=float,
+        default=30,
+        help="(with --wifi-ssid) Seconds to wait for the device to boot and to join the network.",
+    )
+    parser.add_argument(
+        "--write-retries", type=int, default=3, help="How often to reconnect and resume after a failed write"
+    )
     parser.add_argument("--show-logs", help="Only show logs", action="store_true")
-    parser.add_argument("binary", help="The binary image to flash.")
+    parser.add_argument(
+        "--watch-file",
+        help="After flashing, keep the board connected and reflash the changed blocks "
+        "whenever the binary changes or Enter is pressed.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--archive-logs",
+        help="Also store the shown logs in a compressed archive per device (by MAC address).",
+        action="store_true",
+    )
+    parser.add_argument("--query-logs", metavar="MAC", help="Print archived logs of the device with this MAC address.")
+    parser.add_argument("--since", type=parse_time, help="(with --query-logs) Start time, e.g. '2021-01-31 18:00'.")
+    parser.add_argument("--until", type=parse_time, help="(with --query-logs) End time, e.g. '2021-01-31 19:30:00'.")
+    parser.add_argument(
+        "--grep", type=parse_pattern, help="(with --query-logs) Only print lines matching this regular expression."
+    )
+    parser.add_argument(
+        "--release", help="Flash the asset of this WLED release (tag or 'latest') that matches the detected chip."
+    )
+    parser.add_argument("--variant", help="(with --release) The firmware variant to pick, e.g. ethernet.", default="")
+    parser.add_argument("binary", nargs="?", help="The binary image to flash.")
 
-    return parser.parse_args(argv[1:])
+    args = parser.parse_args(argv[1:])
+    if args.query_logs is None and not args.show_logs and (args.binary is None) == (args.release is None):
+        parser.error("either a binary or --release is required, but not both")
+    if args.watch_file and args.binary is None:
+        parser.error("--watch-file requires a binary")
+    return args
 
 
 def select_port(args):
@@ -52,46 +154,214 @@ def select_port(args):
         raise WledFlasherError("No serial port found!")
     if len(ports) != 1:
         print("Found more than one serial port:")
-        for port, desc in ports:
-            print(u" * {} ({})".format(port, desc))
+        for port_info in ports:
+            print(u" * {} ({})".format(port_info.port, port_info.desc))
         print("Please choose one with the --port argument.")
         raise WledFlasherError
-    print(u"Auto-detected serial port: {}".format(ports[0][0]))
-    return ports[0][0]
+    print(u"Auto-detected serial port: {}".format(ports[0].port))
+    return ports[0].port
+
 
+def tail_logs(serial_port, until=None, store=None):
+    """Print log lines until the port closes (returns False) or until() is true (returns True).
 
-def show_logs(serial_port):
+    Lines are also archived to store if one is given.
+    """
+    while until is None or not until():
+        try:
+            raw = serial_port.readline()
+        except serial.SerialException:
+            print("Serial port closed!")
+            return False
+        if not raw:
+            continue
+        text = raw.decode(errors="ignore")
+        line = text.replace("\r", "").replace("\n", "")
+        time = datetime.now().time().strftime("[%H:%M:%S]")
+        message = time + line
+        if store is not None:
+            store.append(datetime.now().timestamp(), line)
+        try:
+            print(message)
+        except UnicodeEncodeError:
+            print(message.encode("ascii", "backslashreplace"))
+    return True
+
+
+def show_logs(serial_port, store=None):
     print("Showing logs:")
     with serial_port:
-        while True:
-            try:
-                raw = serial_port.readline()
-            except serial.SerialException:
-                print("Serial port closed!")
-                return
-            text = raw.decode(errors="ignore")
-            line = text.replace("\r", "").replace("\n", "")
-            time = datetime.now().time().strftime("[%H:%M:%S]")
-            message = time + line
-            try:
-                print(message)
-            except UnicodeEncodeError:
-                print(message.encode("ascii", "backslashreplace"))
-
-
-def run_wledflasher(argv):
+        tail_logs(serial_port, store=store)
+
+
+def open_log_store(args, mac):
+    if not args.archive_logs:
+        return None
+    if mac is None:
+        print("Device MAC address unknown, flash it once to archive its logs.")
+        return None
+    store = LogStore(mac)
+    print("Archiving logs to {}".format(store.path))
+    return store
+
+
+def query_logs(args):
+    found = False
+    for timestamp, line in LogStore(args.query_logs).query(args.since, args.until, args.grep):
+        found = True
+        print(datetime.fromtimestamp(timestamp).strftime("[%Y-%m-%d %H:%M:%S]") + line)
+    if not found:
+        print("No archived logs found for {}".format(args.query_logs))
+
+
+class ReflashTrigger(object):
+    """Callable that turns true once the watched file has changed or Enter was pressed."""
+
+    def __init__(self, path, settle_delay=0.5):
+        self._path = path
+        self._settle_delay = settle_delay
+        self._mtime = self._read_mtime()
+        self._pressed = threading.Event()
+        thread = threading.Thread(target=self._read_keys)
+        thread.daemon = True
+        thread.start()
+
+    def _read_mtime(self):
+        try:
+            return os.stat(self._path).st_mtime
+        except OSError:
+            return None
+
+    def _read_keys(self):
+        for _ in sys.stdin:
+            self._pressed.set()
+
+    def __call__(self):
+        if self._pressed.is_set():
+            self._pressed.clear()
+            return True
+        mtime = self._read_mtime()
+        if mtime is None or mtime == self._mtime:
+            return False
+        # Let the build finish writing the file before we read it
+        time.sleep(self._settle_delay)
+        self._mtime = self._read_mtime()
+        return True
+
+
+def start_stub(chip, upload_baud_rate, flash_size):
+    stub_chip = chip_run_stub(chip)
+    if upload_baud_rate != 115200:
+        try:
+            stub_chip.change_baud(upload_baud_rate)
+        except esptool.FatalError:
+            print("Could not change baud rate, staying at 115200")
+    try:
+        stub_chip.flash_set_parameters(esptool.flash_size_bytes(flash_size))
+    except esptool.FatalError as err:
+        raise WledFlasherError("Error setting flash parameters: {}".format(err))
+    return stub_chip
+
+
+def reset_to_logs(stub_chip, upload_baud_rate):
+    print("Hard Resetting...")
+    stub_chip.hard_reset()
+
+    if upload_baud_rate != 115200:
+        stub_chip._port.baudrate = 115200
+        time.sleep(0.05)  # get rid of crap sent during baud rate change
+        stub_chip._port.flushInput()
+
+
+def open_checked_binary(path):
+    """Open a binary and check its header, returning None after saying why if it cannot be flashed."""
+    try:
+        firmware = open_downloadable_binary(path)
+    except WledFlasherError as err:
+        print("Not reflashing: {}".format(err))
+        return None
+    try:
+        read_firmware_info(firmware)
+    except WledFlasherError as err:
+        firmware.close()
+        print("Not reflashing: {}".format(err))
+        return None
+    return firmware
+
+
+def run_warm_session(args, info, flash_size, stub_chip, mock_args, progress=None, store=None):
+    """Keep the port open and reflash only the changed blocks each time the binary changes."""
+    port = stub_chip._port
+    firmware_address = ESP32_APP_OFFSET if isinstance(info, ESP32ChipInfo) else ESP8266_APP_OFFSET
+    images = prepare_images(stub_chip, mock_args)
+    trigger = ReflashTrigger(args.binary)
+    port.timeout = 0.2
+
+    while True:
+        print("Watching {} for changes, press Enter to reflash now.".format(args.binary))
+        if not tail_logs(port, trigger, store):
+            return
+
+        # Check the new binary while the old one still runs, a half written build keeps the session going
+        firmware = open_checked_binary(args.binary)
+        if firmware is None:
+            continue
+        try:
+            check_images_fit(flash_size, [(firmware_address, firmware)])
+        except WledFlasherError as err:
+            firmware.close()
+            print("Not reflashing: {}".format(err))
+            continue
+
+        start = time.time()
+        chip = CHIP_CLASSES[info.family](port)
+        try:
+            chip.connect()
+        except esptool.FatalError as err:
+            firmware.close()
+            raise WledFlasherError("Error re-entering the bootloader: {}".format(err))
+        stub_chip = start_stub(chip, args.upload_baud_rate, flash_size)
+
+        # Everything but the firmware (bootloader, partitions, filesystem) stays as it is
+        previous = dict(mock_args.addr_filename)[firmware_address]
+        mock_args.addr_filename = [
+            (address, firmware if address == firmware_address else binary)
+            for address, binary in mock_args.addr_filename
+        ]
+        previous.close()
+        new_images = prepare_images(stub_chip, mock_args)
+        written = write_changed_blocks(stub_chip, new_images, images, progress)
+        images = new_images
+        print("Reflashed {} changed bytes in {:.1f} seconds".format(written, time.time() - start))
+
+        reset_to_logs(stub_chip, args.upload_baud_rate)
+
+
+def run_wledflasher(argv, progress=None):
     args = parse_args(argv)
+    if args.query_logs is not None:
+        query_logs(args)
+        return
+
     port = select_port(args)
 
     if args.show_logs:
         serial_port = serial.Serial(port, baudrate=115200)
-        show_logs(serial_port)
+        mac = AdapterIndex.load().get(adapter_key(port), "mac") if args.archive_logs else None
+        store = open_log_store(args, mac)
+        try:
+            show_logs(serial_port, store)
+        finally:
+            if store is not None:
+                store.flush()
         return
 
-    try:
-        firmware = open(args.binary, "rb")
-    except IOError as err:
-        raise WledFlasherError("Error opening binary: {}".format(err))
+    firmware = None
+    if args.binary is not None:
+        try:
+            firmware = open(args.binary, "rb")
+        except IOError as err:
+            raise WledFlasherError("Error opening binary: {}".format(err))
     chip = detect_chip(port, args.esp8266, args.esp32)
     info = read_chip_info(chip)
 
@@ -109,6 +379,9 @@ def run_wledflasher(argv):
         print(" - Chip ID: {:08X}".format(info.chip_id))
 
     print(" - MAC Address: {}".format(info.mac))
+    adapters = AdapterIndex.load()
+    adapters.set(adapter_key(port), "mac", info.mac)
+    adapters.save()
 
     stub_chip = chip_run_stub(chip)
     flash_size = None
@@ -134,7 +407,25 @@ def run_wledflasher(argv):
 
     print(" - Flash Size: {}".format(flash_size))
 
-    mock_args = configure_write_flash_args(info, firmware, flash_size, args.bootloader, args.partitions, args.otadata)
+    if firmware is None:
+        from wledflasher.wled import get_release, select_release_asset
+
+        release = get_release(args.release)
+        asset = select_release_asset(release, info, flash_size, args.variant.lower())
+        print(" - Firmware: {} ({})".format(asset.name, release.tag_name))
+        firmware = open_downloadable_binary(asset.browser_download_url)
+
+    mock_args = configure_write_flash_args(
+        info,
+        firmware,
+        flash_size,
+        args.bootloader,
+        args.partitions,
+        args.otadata,
+        args.config_template,
+        dict(args.config_value),
+        args.fs_dir,
+    )
 
     print(" - Flash Mode: {}".format(mock_args.flash_mode))
     print(" - Flash Frequency: {}Hz".format(mock_args.flash_freq.upper()))
@@ -144,29 +435,51 @@ def run_wledflasher(argv):
     except esptool.FatalError as err:
         raise WledFlasherError("Error setting flash parameters: {}".format(err))
 
+    check_images_fit(mock_args.flash_size, mock_args.addr_filename)
     if not args.no_erase:
+        regions = plan_erase_regions(args.erase, info, flash_size, mock_args)
+        erased, duration = erase_flash_regions(stub_chip, mock_args, regions, progress)
+        print("Erased {} bytes ({}) in {:.1f} seconds".format(erased, args.erase, duration))
+
+    def reconnect():
+        chip = detect_chip(port, args.esp8266, args.esp32)
         try:
-            esptool.erase_flash(stub_chip, mock_args)
-        except esptool.FatalError as err:
-            raise WledFlasherError("Error while erasing flash: {}".format(err))
+            return start_stub(chip, args.upload_baud_rate, flash_size)
+        except (esptool.FatalError, WledFlasherError):
+            chip._port.close()  # pylint: disable=protected-access
+            raise
 
-    try:
-        esptool.write_flash(stub_chip, mock_args)
-    except esptool.FatalError as err:
-        raise WledFlasherError("Error while writing flash: {}".format(err))
+    stub_chip = write_flash_resumable(stub_chip, mock_args, reconnect, args.write_retries, progress)
 
-    print("Hard Resetting...")
-    stub_chip.hard_reset()
+    reset_to_logs(stub_chip, args.upload_baud_rate)
 
     print("Done! Flashing is complete!")
     print()
 
-    if args.upload_baud_rate != 115200:
-        stub_chip._port.baudrate = 115200
-        time.sleep(0.05)  # get rid of crap sent during baud rate change
-        stub_chip._port.flushInput()
-
-    show_logs(stub_chip._port)
+    if args.wifi_ssid is not None:
+        print("Provisioning Wi-Fi network '{}' over Improv...".format(args.wifi_ssid))
+        result = provision_wifi(
+            stub_chip._port, args.wifi_ssid, args.wifi_password, args.provision_timeout, args.provision_timeout
+        )
+        if not result.success:
+            raise WledFlasherError("Wi-Fi provisioning failed: {}".format(result.error))
+        print(" - Device: {}".format(" ".join(result.device_info) or "unknown"))
+        print(" - IP Address: {}".format(result.ip_address or "unknown"))
+        for url in result.urls:
+            print(" - URL: {}".format(url))
+        print()
+
+    store = open_log_store(args, info.mac)
+    try:
+        if args.watch_file:
+            with stub_chip._port:
+                run_warm_session(args, info, flash_size, stub_chip, mock_args, progress, store)
+            return
+
+        show_logs(stub_chip._port, store)
+    finally:
+        if store is not None:
+            store.flush()
 
 
 def main():
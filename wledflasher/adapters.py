@@ -0,0 +1,50 @@
+import json
+import os
+
+from wledflasher.const import ADAPTER_INDEX_PATH
+
+
+class AdapterIndex(object):
+    """Small on-disk index remembering what was last seen behind each USB serial adapter."""
+
+    def __init__(self, path=ADAPTER_INDEX_PATH):
+        self.path = path
+        self._entries = {}
+        self._dirty = False
+
+    @classmethod
+    def load(cls, path=ADAPTER_INDEX_PATH):
+        index = cls(path)
+        try:
+            with open(path, "r") as index_file:
+                entries = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            # A missing or corrupt index only costs us a chip probe
+            return index
+        if isinstance(entries, dict):
+            index._entries = entries
+        return index
+
+    def get(self, key, field):
+        if key is None:
+            return None
+        return self._entries.get(key, {}).get(field)
+
+    def set(self, key, field, value):
+        if key is None or self.get(key, field) == value:
+            return
+        self._entries.setdefault(key, {})[field] = value
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as index_file:
+                json.dump(self._entries, index_file, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except (IOError, OSError):
+            return
+        self._dirty = False
@@ -1,10 +1,24 @@
 import io
 import struct
+import time
 
 import esptool
+import serial
 
-from wledflasher.const import HTTP_REGEX
-from wledflasher.helpers import prevent_print
+from wledflasher.adapters import AdapterIndex
+from wledflasher.const import (
+    ERASE_FULL,
+    ERASE_REGIONS_FILESYSTEM,
+    ESP32_APP_OFFSET,
+    ESP32_PARTITION_TABLE_OFFSET,
+    ESP8266_APP_OFFSET,
+    ESP8266_FILESYSTEM_REGIONS,
+    HTTP_REGEX,
+    PROGRESS_LABELS,
+)
+from wledflasher.helpers import adapter_key, prevent_print
+
+CHIP_CLASSES = {klass.CHIP_NAME: klass for klass in (esptool.ESP8266ROM, esptool.ESP32ROM)}
 
 
 class WledFlasherError(Exception):
@@ -25,6 +39,46 @@ class MockEsptoolArgs(object):
         self.encrypt = False
 
 
+class ProgressEvent(object):
+    def __init__(self, phase, done, total, rate):
+        self.phase = phase
+        self.done = done
+        self.total = total
+        self.rate = rate
+
+    @property
+    def eta(self):
+        if not self.rate:
+            return None
+        return (self.total - self.done) / self.rate
+
+
+class ProgressTracker(object):
+    """Turns byte counts of one phase into ProgressEvents for a progress callback."""
+
+    def __init__(self, callback, phase, total, done=0):
+        self._callback = callback or print_progress
+        self._phase = phase
+        self._total = total
+        self._start_done = done
+        self._start = time.time()
+
+    def update(self, done):
+        elapsed = time.time() - self._start
+        rate = (done - self._start_done) / elapsed if elapsed > 0 else 0.0
+        self._callback(ProgressEvent(self._phase, done, self._total, rate))
+
+
+def print_progress(event):
+    percent = 100 * event.done // event.total if event.total else 100
+    print(
+        "\r{}... ({} %, {:.1f} kB/s)".format(PROGRESS_LABELS.get(event.phase, event.phase), percent, event.rate / 1000),
+        end="",
+    )
+    if event.done >= event.total:
+        print()
+
+
 class ChipInfo(object):
     def __init__(self, family, model, mac):
         self.family = family
@@ -123,6 +177,8 @@ def detect_flash_size(stub_chip):
 def read_firmware_info(firmware):
     header = firmware.read(4)
     firmware.seek(0)
+    if len(header) < 4:
+        raise WledFlasherError("The firmware binary is invalid (only {} bytes long)".format(len(header)))
 
     magic, _, flash_mode_raw, flash_size_freq = struct.unpack("BBBB", header)
     if magic != esptool.ESPLoader.ESP_IMAGE_MAGIC:
@@ -142,20 +198,9 @@ def open_downloadable_binary(path):
         return path
 
     if HTTP_REGEX.match(path) is not None:
-        import requests
+        from wledflasher.download import download_binary
 
-        try:
-            response = requests.get(path)
-            response.raise_for_status()
-        except requests.exceptions.Timeout as err:
-            raise WledFlasherError("Timeout while retrieving firmware file '{}': {}".format(path, err))
-        except requests.exceptions.RequestException as err:
-            raise WledFlasherError("Error while retrieving firmware file '{}': {}".format(path, err))
-
-        binary = io.BytesIO()
-        binary.write(response.content)
-        binary.seek(0)
-        return binary
+        return download_binary(path)
 
     try:
         return open(path, "rb")
@@ -167,7 +212,17 @@ def format_bootloader_path(path, flash_mode, flash_freq):
     return path.replace("$FLASH_MODE$", flash_mode).replace("$FLASH_FREQ$", flash_freq)
 
 
-def configure_write_flash_args(info, firmware_path, flash_size, bootloader_path, partitions_path, otadata_path):
+def configure_write_flash_args(
+    info,
+    firmware_path,
+    flash_size,
+    bootloader_path,
+    partitions_path,
+    otadata_path,
+    config_template=None,
+    config_values=None,
+    fs_dir=None,
+):
     addr_filename = []
     firmware = open_downloadable_binary(firmware_path)
     flash_mode, flash_freq = read_firmware_info(firmware)
@@ -179,12 +234,143 @@ def configure_write_flash_args(info, firmware_path, flash_size, bootloader_path,
         otadata = open_downloadable_binary(otadata_path)
 
         addr_filename.append((0x1000, bootloader))
-        addr_filename.append((0x8000, partitions))
+        addr_filename.append((ESP32_PARTITION_TABLE_OFFSET, partitions))
         addr_filename.append((0xE000, otadata))
-        addr_filename.append((0x10000, firmware))
+        addr_filename.append((ESP32_APP_OFFSET, firmware))
     else:
-        addr_filename.append((0x0, firmware))
-    return MockEsptoolArgs(flash_size, addr_filename, flash_mode, flash_freq)
+        addr_filename.append((ESP8266_APP_OFFSET, firmware))
+    mock_args = MockEsptoolArgs(flash_size, addr_filename, flash_mode, flash_freq)
+
+    if config_template is not None:
+        from wledflasher.fsimage import build_filesystem_image
+
+        region = filesystem_region(info, flash_size, mock_args)
+        if region is None:
+            raise WledFlasherError(
+                "Could not find the filesystem region for {} with {} flash".format(info.family, flash_size)
+            )
+        fs_offset, fs_size = region
+        fs_image = build_filesystem_image(info, flash_size, fs_size, config_template, config_values, fs_dir)
+        addr_filename.append((fs_offset, fs_image))
+    return mock_args
+
+
+def binary_size(binary):
+    binary.seek(0, io.SEEK_END)
+    size = binary.tell()
+    binary.seek(0)
+    return size
+
+
+def align_region(offset, size, block_size=esptool.ESPLoader.FLASH_SECTOR_SIZE):
+    start = offset - offset % block_size
+    end = offset + size
+    end += -end % block_size
+    return start, end - start
+
+
+def merge_regions(regions):
+    merged = []
+    for offset, size in sorted(regions):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            last_offset, last_size = merged[-1]
+            merged[-1] = (last_offset, max(last_size, offset + size - last_offset))
+        else:
+            merged.append((offset, size))
+    return merged
+
+
+def read_partition_table(partitions):
+    """Return (type, subtype, offset, size, label) tuples from an ESP32 partition table binary."""
+    data = partitions.read()
+    partitions.seek(0)
+    result = []
+    for pos in range(0, len(data) - 31, 32):
+        magic, type_, subtype, offset, size, label, _ = struct.unpack("<2sBBII16sI", data[pos : pos + 32])
+        if magic != b"\xaa\x50":
+            break
+        result.append((type_, subtype, offset, size, label.rstrip(b"\x00").decode(errors="ignore")))
+    return result
+
+
+def filesystem_region(info, flash_size, mock_args):
+    if isinstance(info, ESP32ChipInfo):
+        partitions = dict(mock_args.addr_filename).get(ESP32_PARTITION_TABLE_OFFSET)
+        if partitions is None:
+            return None
+        for type_, subtype, offset, size, _ in read_partition_table(partitions):
+            # data partition with a fat, spiffs or littlefs subtype
+            if type_ == 0x01 and subtype in (0x81, 0x82, 0x83):
+                return offset, size
+        return None
+    return ESP8266_FILESYSTEM_REGIONS.get(flash_size)
+
+
+def check_images_fit(flash_size, addr_filename):
+    """Refuse images that run past the end of flash, SPI flash wraps such writes around onto the bootloader."""
+    flash_bytes = esptool.flash_size_bytes(flash_size)
+    for address, binary in addr_filename:
+        size = binary_size(binary)
+        if address + size > flash_bytes:
+            raise WledFlasherError(
+                "Image at 0x{:08X} ({} bytes) will not fit in {} bytes of flash".format(address, size, flash_bytes)
+            )
+
+
+def plan_erase_regions(strategy, info, flash_size, mock_args):
+    """Return the block-aligned regions to erase for a strategy, or None to erase the whole chip."""
+    if strategy == ERASE_FULL:
+        return None
+    regions = [align_region(address, binary_size(binary)) for address, binary in mock_args.addr_filename]
+    if strategy == ERASE_REGIONS_FILESYSTEM:
+        region = filesystem_region(info, flash_size, mock_args)
+        if region is None:
+            raise WledFlasherError(
+                "Could not find the filesystem region for {} with {} flash".format(info.family, flash_size)
+            )
+        regions.append(align_region(*region))
+    return merge_regions(regions)
+
+
+def erase_flash_regions(stub_chip, mock_args, regions, progress=None):
+    """Erase the given regions (or the whole chip for None), returning (bytes erased, seconds taken)."""
+    start = time.time()
+    try:
+        if regions is None:
+            total = esptool.flash_size_bytes(mock_args.flash_size)
+            tracker = ProgressTracker(progress, "erase", total)
+            tracker.update(0)
+            prevent_print(esptool.erase_flash, stub_chip, mock_args)
+            erased = total
+            tracker.update(erased)
+        else:
+            tracker = ProgressTracker(progress, "erase", sum(size for _, size in regions))
+            erased = 0
+            tracker.update(erased)
+            for offset, size in regions:
+                stub_chip.erase_region(offset, size)
+                erased += size
+                tracker.update(erased)
+    except esptool.FatalError as err:
+        raise WledFlasherError("Error while erasing flash: {}".format(err))
+    return erased, time.time() - start
+
+
+def connect_known_chip(port, klass):
+    """Connect to a chip of an already known class, returning None if the board turns out to be different."""
+    chip = klass(port)
+    try:
+        chip.connect()
+        # Same check ESPLoader.detect_chip does, without the extra sync and class round trip
+        date_reg = chip.read_reg(esptool.ESPLoader.UART_DATA_REG_ADDR)
+    except esptool.FatalError as err:
+        # Probing again would only reset and fail the same way
+        chip._port.close()  # pylint: disable=protected-access
+        raise WledFlasherError("Error connecting to ESP: {}".format(err))
+    if date_reg != klass.DATE_REG_VALUE:
+        chip._port.close()  # pylint: disable=protected-access
+        return None
+    return chip
 
 
 def detect_chip(port, force_esp8266=False, force_esp32=False):
@@ -192,14 +378,30 @@ def detect_chip(port, force_esp8266=False, force_esp32=False):
         klass = esptool.ESP32ROM if force_esp32 else esptool.ESP8266ROM
         chip = klass(port)
     else:
+        index = AdapterIndex.load()
+        key = adapter_key(port)
+        klass = CHIP_CLASSES.get(index.get(key, "family"))
+        if klass is not None:
+            chip = connect_known_chip(port, klass)
+            if chip is not None:
+                return chip
+            print("Chip behind this adapter has changed, probing again")
+
+        # Open the port ourselves, esptool leaves it open when detection fails
+        serial_port = serial.serial_for_url(port)
         try:
-            chip = esptool.ESPLoader.detect_chip(port)
+            chip = esptool.ESPLoader.detect_chip(serial_port)
         except esptool.FatalError as err:
+            serial_port.close()
             raise WledFlasherError("ESP Chip Auto-Detection failed: {}".format(err))
 
+        index.set(key, "family", chip.CHIP_NAME)
+        index.save()
+
     try:
         chip.connect()
     except esptool.FatalError as err:
+        chip._port.close()  # pylint: disable=protected-access
         raise WledFlasherError("Error connecting to ESP: {}".format(err))
 
     return chip
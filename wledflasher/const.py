@@ -1,3 +1,4 @@
+import os
 import re
 
 __version__ = "0.0.1"
@@ -13,5 +14,58 @@ ESP32_DEFAULT_PARTITIONS = (
     "https://raw.githubusercontent.com/espressif/arduino-esp32/1.0.4/tools/partitions/default.bin"
 )
 
+# (offset, size) of the filesystem in the ESP8266 flash layouts WLED builds with (eagle.flash.1m128/2m512/4m1m.ld)
+ESP8266_FILESYSTEM_REGIONS = {
+    "1MB": (0xDB000, 0x20000),
+    "2MB": (0x180000, 0x7A000),
+    "4MB": (0x300000, 0xFA000),
+}
+# _FS_block of those layouts, the core uses 4 KiB blocks for filesystems under 512 KB and 8 KiB above
+ESP8266_FILESYSTEM_BLOCK_SIZES = {
+    "1MB": 0x1000,
+    "2MB": 0x2000,
+    "4MB": 0x2000,
+}
+ESP32_PARTITION_TABLE_OFFSET = 0x8000
+ESP32_APP_OFFSET = 0x10000
+ESP8266_APP_OFFSET = 0x0
+
+# LittleFS settings of the ESP8266 Arduino core and the ESP32 LITTLEFS library WLED builds with, as mklittlefs
+# uses them (the ESP8266 block size depends on the layout). Both only mount the v2.0 on-disk format, not the v2.1
+# newer littlefs versions write by default.
+LITTLEFS_DISK_VERSION = 0x00020000
+ESP8266_LITTLEFS_CONFIG = {
+    "read_size": 64,
+    "prog_size": 64,
+    "cache_size": 64,
+    "lookahead_size": 64,
+    "block_cycles": 16,
+    "name_max": 32,
+}
+ESP32_LITTLEFS_CONFIG = {
+    "block_size": 4096,
+    "read_size": 128,
+    "prog_size": 128,
+    "cache_size": 512,
+    "lookahead_size": 128,
+    "block_cycles": 512,
+    "name_max": 64,
+}
+
+ERASE_FULL = "full"
+ERASE_REGIONS = "regions"
+ERASE_REGIONS_FILESYSTEM = "regions-fs"
+ERASE_STRATEGIES = (ERASE_FULL, ERASE_REGIONS, ERASE_REGIONS_FILESYSTEM)
+
+PROGRESS_LABELS = {"erase": "Erasing", "write": "Writing"}
+
 # https://stackoverflow.com/a/3809435/8924614
 HTTP_REGEX = re.compile(r"https?://(www\.)?[-a-zA-Z0-9@:%._+~#=]{2,256}\.[a-z]{2,6}\b([-a-zA-Z0-9@:%_+.~#?&/=]*)")
+
+CACHE_DIR = os.getenv("WLEDFLASHER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".wledflasher"))
+ADAPTER_INDEX_PATH = os.path.join(CACHE_DIR, "adapters.json")
+ASSET_INDEX_DIR = os.path.join(CACHE_DIR, "assets")
+LOG_ARCHIVE_DIR = os.path.join(CACHE_DIR, "logs")
+FS_IMAGE_CACHE_DIR = os.path.join(CACHE_DIR, "fsimages")
+# Base URLs serving the same paths as the download URLs (e.g. a GitHub release mirror), tried in order on failure
+DOWNLOAD_MIRRORS = [mirror for mirror in re.split(r"[\s,]+", os.getenv("WLEDFLASHER_MIRRORS", "")) if mirror]
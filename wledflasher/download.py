@@ -0,0 +1,174 @@
+from __future__ import print_function
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import re
+import tempfile
+import threading
+import time
+from urllib.parse import urldefrag, urlparse
+
+import requests
+
+from wledflasher.common import WledFlasherError
+from wledflasher.const import DOWNLOAD_MIRRORS
+
+# Smaller files are fetched over a single connection, splitting them costs more round trips than it saves
+RANGED_DOWNLOAD_THRESHOLD = 1024 * 1024
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_TIMEOUT = (10, 30)
+READ_CHUNK_SIZE = 64 * 1024
+# A download slower than this over all its connections after the grace period makes us try the next mirror
+MIN_DOWNLOAD_RATE = 20 * 1024
+SLOW_GRACE_PERIOD = 5.0
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+SHA256_FRAGMENT_RE = re.compile(r"^sha256=([0-9a-fA-F]{64})$")
+# Ranges and lengths are only comparable with what we receive if the server does not compress the body
+IDENTITY_ENCODING = {"Accept-Encoding": "identity"}
+
+
+class DownloadError(Exception):
+    pass
+
+
+def mirror_urls(url, mirrors=DOWNLOAD_MIRRORS):
+    """The URL itself followed by the same path on each configured mirror."""
+    path = urlparse(url).path
+    return [url] + ["{}{}".format(mirror.rstrip("/"), path) for mirror in mirrors]
+
+
+class TransferRate(object):
+    """Bytes received over all connections of one download, to give up on a server that is too slow.
+
+    Only a download that has another mirror to try gives up, the last one is slow rather than failed.
+    """
+
+    def __init__(self, give_up_when_slow=True):
+        self._give_up_when_slow = give_up_when_slow
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._received = 0
+
+    def add(self, count):
+        with self._lock:
+            self._received += count
+            received = self._received
+        elapsed = time.time() - self._start
+        if self._give_up_when_slow and elapsed > SLOW_GRACE_PERIOD and received / elapsed < MIN_DOWNLOAD_RATE:
+            raise DownloadError("download too slow ({:.1f} kB/s)".format(received / elapsed / 1000))
+
+
+def stream_into(response, output, lock, start, length, abort, rate):
+    """Copy a response body into output at start, checking length (unless None) and throughput as it goes."""
+    received = 0
+    for chunk in response.iter_content(READ_CHUNK_SIZE):
+        if abort.is_set():
+            raise DownloadError("aborted")
+        if length is not None and received + len(chunk) > length:
+            raise DownloadError("server sent more data than requested")
+        with lock:
+            output.seek(start + received)
+            output.write(chunk)
+        received += len(chunk)
+        rate.add(len(chunk))
+    if length is not None and received != length:
+        raise DownloadError("connection closed after {} of {} bytes".format(received, length))
+
+
+def fetch_range(url, output, lock, start, length, abort, rate):
+    headers = dict(IDENTITY_ENCODING, Range="bytes={}-{}".format(start, start + length - 1))
+    with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise DownloadError("server ignored the range request")
+        stream_into(response, output, lock, start, length, abort, rate)
+
+
+def probe(url):
+    """Return (url after redirects, size, None) if the server supports ranges, else (url, None, full response)."""
+    headers = dict(IDENTITY_ENCODING, Range="bytes=0-0")
+    response = requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    if response.status_code == 206:
+        match = CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+        response.close()
+        if match is not None:
+            return response.url, int(match.group(3)), None
+        response = requests.get(url, headers=IDENTITY_ENCODING, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+    return response.url, None, response
+
+
+def download_from(url, give_up_when_slow=True):
+    output = tempfile.TemporaryFile()
+    lock = threading.Lock()
+    abort = threading.Event()
+    rate = TransferRate(give_up_when_slow)
+    try:
+        final_url, size, response = probe(url)
+        if response is not None:
+            # No range support, the probe response already is the whole file
+            with response:
+                length = response.headers.get("Content-Length")
+                if response.headers.get("Content-Encoding", "identity") != "identity":
+                    # Compressed anyway, the length is that of the encoded body and not of what we receive
+                    length = None
+                stream_into(response, output, lock, 0, int(length) if length is not None else None, abort, rate)
+        elif size < RANGED_DOWNLOAD_THRESHOLD:
+            output.truncate(size)
+            fetch_range(final_url, output, lock, 0, size, abort, rate)
+        else:
+            output.truncate(size)
+            part_size = -(-size // DOWNLOAD_CONNECTIONS)
+            parts = [(start, min(part_size, size - start)) for start in range(0, size, part_size)]
+            with ThreadPoolExecutor(len(parts)) as executor:
+                futures = [
+                    executor.submit(fetch_range, final_url, output, lock, start, length, abort, rate)
+                    for start, length in parts
+                ]
+                try:
+                    for future in futures:
+                        future.result()
+                except Exception:
+                    abort.set()
+                    raise
+    except (requests.exceptions.RequestException, DownloadError):
+        output.close()
+        raise
+    output.seek(0)
+    return output
+
+
+def file_sha256(output):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: output.read(READ_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    output.seek(0)
+    return digest.hexdigest()
+
+
+def download_binary(url, expected_sha256=None, mirrors=DOWNLOAD_MIRRORS):
+    """Download url (trying mirrors in turn) into a temporary file, in parallel ranges where the server allows.
+
+    The expected SHA-256 can also be given as a '#sha256=...' URL fragment.
+    """
+    url, fragment = urldefrag(url)
+    match = SHA256_FRAGMENT_RE.match(fragment)
+    if expected_sha256 is None and match is not None:
+        expected_sha256 = match.group(1)
+
+    errors = []
+    candidates = mirror_urls(url, mirrors)
+    for i, candidate in enumerate(candidates):
+        try:
+            output = download_from(candidate, give_up_when_slow=i + 1 < len(candidates))
+        except (requests.exceptions.RequestException, DownloadError) as err:
+            errors.append("{}: {}".format(candidate, err))
+        else:
+            if expected_sha256 is None or file_sha256(output) == expected_sha256.lower():
+                return output
+            output.close()
+            errors.append("{}: SHA-256 does not match".format(candidate))
+        if i + 1 < len(candidates):
+            print("Download from {} failed, trying the next mirror".format(candidate))
+    raise WledFlasherError("Error while retrieving firmware file '{}': {}".format(url, "; ".join(errors)))
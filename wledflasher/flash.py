@@ -0,0 +1,172 @@
+from __future__ import print_function
+
+import hashlib
+import time
+import zlib
+
+import esptool
+import serial
+
+from wledflasher.common import ProgressTracker, WledFlasherError, check_images_fit
+from wledflasher.helpers import prevent_print
+
+# Unit of work that is confirmed by MD5 and can be resumed from, a multiple of the erase block size
+WRITE_CHUNK_SIZE = 0x10000
+RETRY_DELAY = 1.0
+
+
+class FlashCheckpoint(object):
+    """Per-region list of chunk MD5s that were written and confirmed on the chip."""
+
+    def __init__(self):
+        self._regions = {}
+
+    def confirmed(self, address):
+        return self._regions.setdefault(address, [])
+
+    def confirm(self, address, md5):
+        self.confirmed(address).append(md5)
+
+    def resume_offset(self, address):
+        return len(self.confirmed(address)) * WRITE_CHUNK_SIZE
+
+
+def prepare_images(stub_chip, mock_args):
+    check_images_fit(mock_args.flash_size, mock_args.addr_filename)
+    images = []
+    for address, binary in mock_args.addr_filename:
+        image = esptool.pad_to(binary.read(), 4)
+        binary.seek(0)
+        if not image:
+            continue
+        image = esptool._update_image_flash_params(  # pylint: disable=protected-access
+            stub_chip, address, mock_args, image
+        )
+        images.append((address, image))
+    return images
+
+
+def write_chunk(stub_chip, address, data):
+    compressed = zlib.compress(data, 9)
+    ratio = len(data) / len(compressed)
+    # esptool prints a "Compressed ..." line per call, that is once per chunk here
+    prevent_print(stub_chip.flash_defl_begin, len(data), len(compressed), address)
+    seq = 0
+    while compressed:
+        block = compressed[: stub_chip.FLASH_WRITE_SIZE]
+        stub_chip.flash_defl_block(block, seq, timeout=esptool.DEFAULT_TIMEOUT * ratio * 2)
+        compressed = compressed[stub_chip.FLASH_WRITE_SIZE :]
+        seq += 1
+    expected = hashlib.md5(data).hexdigest()
+    if stub_chip.flash_md5sum(address, len(data)) != expected:
+        raise esptool.FatalError("MD5 of data at 0x{:08X} does not match data in flash".format(address))
+    return expected
+
+
+def verify_checkpoint(stub_chip, images, checkpoint):
+    """Drop confirmed chunks from the end of each region until the last one still matches the flash."""
+    for address, image in images:
+        confirmed = checkpoint.confirmed(address)
+        while confirmed:
+            offset = (len(confirmed) - 1) * WRITE_CHUNK_SIZE
+            length = min(WRITE_CHUNK_SIZE, len(image) - offset)
+            if stub_chip.flash_md5sum(address + offset, length) == confirmed[-1]:
+                break
+            confirmed.pop()
+        if confirmed:
+            print("Resuming 0x{:08X} at 0x{:08X}".format(address, address + checkpoint.resume_offset(address)))
+
+
+def write_images(stub_chip, images, checkpoint, progress=None):
+    total = sum(len(image) for _, image in images)
+    done = sum(min(checkpoint.resume_offset(address), len(image)) for address, image in images)
+    tracker = ProgressTracker(progress, "write", total, done)
+    tracker.update(done)
+    start = time.time()
+    for address, image in images:
+        for offset in range(checkpoint.resume_offset(address), len(image), WRITE_CHUNK_SIZE):
+            data = image[offset : offset + WRITE_CHUNK_SIZE]
+            checkpoint.confirm(address, write_chunk(stub_chip, address + offset, data))
+            done += len(data)
+            tracker.update(done)
+    print("Wrote {} bytes in {:.1f} seconds, hash of data verified.".format(total, time.time() - start))
+
+
+def write_flash_resumable(stub_chip, mock_args, reconnect, retries=3, progress=None):
+    """Write the images in mock_args chunk by chunk, reconnecting and resuming after failures.
+
+    reconnect is called with no arguments after a failure and must return a fresh stub chip with
+    the flash parameters set. progress receives ProgressEvents for the write. Returns the stub chip
+    that finished the write.
+    """
+    images = prepare_images(stub_chip, mock_args)
+    checkpoint = FlashCheckpoint()
+    attempt = 0
+    while True:
+        try:
+            if attempt:
+                stub_chip = reconnect()
+                verify_checkpoint(stub_chip, images, checkpoint)
+            write_images(stub_chip, images, checkpoint, progress)
+            break
+        except (esptool.FatalError, serial.SerialException, WledFlasherError) as err:
+            attempt += 1
+            if attempt > retries:
+                raise WledFlasherError("Error while writing flash: {}".format(err))
+            print()
+            print("Write interrupted ({}), reconnecting ({}/{})...".format(err, attempt, retries))
+            stub_chip._port.close()  # pylint: disable=protected-access
+            time.sleep(RETRY_DELAY)
+
+    finish_flash(stub_chip)
+    return stub_chip
+
+
+def finish_flash(stub_chip):
+    try:
+        # Like esptool, skip flash_finish so the stub keeps running until we reset
+        prevent_print(stub_chip.flash_begin, 0, 0)
+        stub_chip.flash_defl_finish(False)
+    except esptool.FatalError as err:
+        raise WledFlasherError("Error while finishing flash write: {}".format(err))
+
+
+def changed_regions(old, new, block_size=esptool.ESPLoader.FLASH_SECTOR_SIZE):
+    """Return (offset, length) runs of erase blocks in new that differ from old."""
+    regions = []
+    for offset in range(0, len(new), block_size):
+        block = new[offset : offset + block_size]
+        if old[offset : offset + block_size] == block:
+            continue
+        if regions and sum(regions[-1]) == offset:
+            regions[-1] = (regions[-1][0], regions[-1][1] + len(block))
+        else:
+            regions.append((offset, len(block)))
+    return regions
+
+
+def write_changed_blocks(stub_chip, images, previous_images, progress=None):
+    """Write only the erase blocks of images that differ from what previous_images put on the chip.
+
+    Returns the number of bytes written.
+    """
+    previous = dict(previous_images)
+    writes = []
+    for address, image in images:
+        for offset, length in changed_regions(previous.get(address, b""), image):
+            for chunk in range(offset, offset + length, WRITE_CHUNK_SIZE):
+                writes.append((address + chunk, image[chunk : min(chunk + WRITE_CHUNK_SIZE, offset + length)]))
+
+    total = sum(len(data) for _, data in writes)
+    tracker = ProgressTracker(progress, "write", total)
+    tracker.update(0)
+    done = 0
+    try:
+        for address, data in writes:
+            write_chunk(stub_chip, address, data)
+            done += len(data)
+            tracker.update(done)
+    except esptool.FatalError as err:
+        raise WledFlasherError("Error while writing flash: {}".format(err))
+    finish_flash(stub_chip)
+    return total
@@ -0,0 +1,132 @@
+import hashlib
+import io
+import json
+import os
+from string import Template
+
+from wledflasher.common import ESP32ChipInfo, WledFlasherError
+from wledflasher.const import (
+    ESP32_LITTLEFS_CONFIG,
+    ESP8266_FILESYSTEM_BLOCK_SIZES,
+    ESP8266_LITTLEFS_CONFIG,
+    FS_IMAGE_CACHE_DIR,
+    LITTLEFS_DISK_VERSION,
+)
+
+CONFIG_FILE_NAME = "cfg.json"
+
+
+def device_values(info, values=None):
+    """Values available to the cfg.json template, user values override the ones derived from the chip."""
+    mac_suffix = info.mac.replace(":", "")[-6:].lower()
+    result = {
+        "mac": info.mac,
+        "mac_suffix": mac_suffix,
+        "hostname": "wled-{}".format(mac_suffix),
+    }
+    result.update(values or {})
+    return result
+
+
+def json_escape(value):
+    """Escape a value for use inside a JSON string literal of the template."""
+    return json.dumps(str(value))[1:-1]
+
+
+def render_config(template_path, values):
+    values = {key: json_escape(value) for key, value in values.items()}
+    try:
+        with open(template_path, "r") as template_file:
+            template = Template(template_file.read())
+    except IOError as err:
+        raise WledFlasherError("Error opening config template '{}': {}".format(template_path, err))
+    try:
+        rendered = template.substitute(values)
+    except (KeyError, ValueError) as err:
+        raise WledFlasherError("Error filling config template '{}': missing value {}".format(template_path, err))
+    try:
+        json.loads(rendered)
+    except ValueError as err:
+        raise WledFlasherError("Config template '{}' does not render to valid JSON: {}".format(template_path, err))
+    return rendered.encode("utf-8")
+
+
+def read_static_files(static_dir):
+    files = {}
+    if static_dir is None:
+        return files
+    for name in sorted(os.listdir(static_dir)):
+        path = os.path.join(static_dir, name)
+        if os.path.isfile(path) and name != CONFIG_FILE_NAME:
+            with open(path, "rb") as static_file:
+                files[name] = static_file.read()
+    return files
+
+
+def littlefs_config(info, flash_size, fs_size):
+    """LittleFS configuration of the filesystem driver on the chip, for a filesystem of fs_size bytes."""
+    if isinstance(info, ESP32ChipInfo):
+        config = dict(ESP32_LITTLEFS_CONFIG)
+    else:
+        if flash_size not in ESP8266_FILESYSTEM_BLOCK_SIZES:
+            raise WledFlasherError("No filesystem layout known for ESP8266 with {} flash".format(flash_size))
+        config = dict(ESP8266_LITTLEFS_CONFIG, block_size=ESP8266_FILESYSTEM_BLOCK_SIZES[flash_size])
+    config["block_count"] = fs_size // config["block_size"]
+    return config
+
+
+def open_littlefs(config, image=None):
+    try:
+        from littlefs import LittleFS, LittleFSError
+    except ImportError:
+        raise WledFlasherError("Building a filesystem image requires littlefs-python (pip install littlefs-python)")
+
+    try:
+        if image is None:
+            return LittleFS(disk_version=LITTLEFS_DISK_VERSION, **config)
+        fs = LittleFS(mount=False, disk_version=LITTLEFS_DISK_VERSION, **config)
+        fs.context.buffer[:] = image
+        fs.mount()
+        return fs
+    except LittleFSError as err:
+        raise WledFlasherError("Error preparing the filesystem image: {}".format(err))
+
+
+def build_base_image(config, static_files):
+    """Return a LittleFS image with the static files, built once per configuration and content and then cached."""
+    digest = hashlib.sha256(json.dumps(dict(config, disk_version=LITTLEFS_DISK_VERSION), sort_keys=True).encode())
+    for name, data in static_files.items():
+        digest.update(name.encode("utf-8") + b"\0" + hashlib.sha256(data).digest())
+    path = os.path.join(FS_IMAGE_CACHE_DIR, "{}.bin".format(digest.hexdigest()))
+    try:
+        with open(path, "rb") as image_file:
+            image = image_file.read()
+        if len(image) == config["block_size"] * config["block_count"]:
+            return image
+    except (IOError, OSError):
+        pass
+
+    fs = open_littlefs(config)
+    for name, data in static_files.items():
+        with fs.open(name, "wb") as static_file:
+            static_file.write(data)
+    image = bytes(fs.context.buffer)
+    try:
+        os.makedirs(FS_IMAGE_CACHE_DIR, exist_ok=True)
+        with open(path, "wb") as image_file:
+            image_file.write(image)
+    except (IOError, OSError):
+        pass
+    return image
+
+
+def build_filesystem_image(info, flash_size, fs_size, template_path, values=None, static_dir=None):
+    """Build the filesystem image for one board: the cached base image with its own cfg.json written in."""
+    config = littlefs_config(info, flash_size, fs_size)
+    base = build_base_image(config, read_static_files(static_dir))
+    rendered = render_config(template_path, device_values(info, values))
+
+    fs = open_littlefs(config, base)
+    with fs.open(CONFIG_FILE_NAME, "wb") as config_file:
+        config_file.write(rendered)
+    return io.BytesIO(bytes(fs.context.buffer))
@@ -2,7 +2,8 @@
 import re
 import sys
 import threading
-from typing import BinaryIO
+import time
+from typing import BinaryIO, Optional
 import os
 
 import wx
@@ -11,12 +12,16 @@ import wx.svg
 import wx.lib.inspection
 import wx.lib.mixins.inspection
 
+from wledflasher.const import PROGRESS_LABELS
 from wledflasher.helpers import list_serial_ports
 from wledflasher.wled import get_releases, download_firmware
 from wledflasher.__main__ import run_wledflasher
 
 
 APP_NAME = "WLED Flasher"
+AUTO_ASSET_LABEL = "Auto (match connected board)"
+# Seconds between progress gauge updates, keeps the UI responsive at high baud rates
+PROGRESS_UPDATE_INTERVAL = 1 / 25
 COLOR_RE = re.compile(r"(?:\033)(?:\[(.*?)[@-~]|\].*?(?:\007|\033\\))")
 COLORS = {
     "black": wx.BLACK,
@@ -163,21 +168,27 @@ class VersionChoice(wx.Choice):
 
 
 class FlashingThread(threading.Thread):
-    def __init__(self, parent, firmware: BinaryIO, port, show_logs=False):
+    def __init__(self, parent, firmware: Optional[BinaryIO], port, show_logs=False, release=None):
         threading.Thread.__init__(self)
         self.daemon = True
         self._parent = parent
         self._firmware = firmware
         self._port = port
         self._show_logs = show_logs
+        self._release = release
 
     def run(self):
         try:
-            argv = ["wledflasher", "--port", self._port, self._firmware.name]
+            argv = ["wledflasher", "--port", self._port]
             if self._show_logs:
                 argv.append("--show-logs")
-            run_wledflasher(argv)
-            self._firmware.close()
+            elif self._firmware is not None:
+                argv.append(self._firmware.name)
+            else:
+                argv.extend(["--release", self._release])
+            run_wledflasher(argv, progress=self._parent.on_progress)
+            if self._firmware is not None:
+                self._firmware.close()
         except Exception as error:
             print("Unexpected error: {}".format(error))
             raise
@@ -191,7 +202,9 @@ class MainFrame(wx.Frame):
 
         self._firmware = None
         self._port = None
+        self._release = None
         self._version = None
+        self._last_progress = 0.0
 
         self._init_ui()
 
@@ -208,6 +221,14 @@ class MainFrame(wx.Frame):
         def on_clicked(event: wx.CommandEvent):  # pylint: disable=unused-argument
             # self.console_ctrl.SetValue("")
 
+            if self._version is None:
+                if self._release is None:
+                    print("Select a version to flash")
+                    return
+                worker = FlashingThread(self, None, self._port, release=self._release.tag_name)
+                worker.start()
+                return
+
             firmware_file = download_firmware(self._version)
 
             worker = FlashingThread(self, firmware_file, self._port)
@@ -215,7 +236,7 @@ class MainFrame(wx.Frame):
 
         def on_logs_clicked(event):  # pylint: disable=unused-argument
             self.console_ctrl.SetValue("")
-            worker = FlashingThread(self, "dummy", self._port, show_logs=True)
+            worker = FlashingThread(self, None, self._port, show_logs=True)
             worker.start()
 
         def on_select_port(event):
@@ -228,13 +249,16 @@ class MainFrame(wx.Frame):
         def on_pick_release(event: wx.CommandEvent):
             # self._version = event.GetString()
             release = event.GetClientData()
+            self._release = release
+            self._version = None
             self.bin_picker.Clear()
 
             if release:
+                self.bin_picker.Append(AUTO_ASSET_LABEL, None)
+                self.bin_picker.SetSelection(0)
                 for asset in release.get_assets():
                     if asset.name.endswith(".bin"):
                         self.bin_picker.Append(asset.name, asset)
-                self._version = self.bin_picker.GetClientData(self.bin_picker.CurrentSelection)
 
             # print([asset.name for asset in list(release.get_assets()) if asset.name.endswith(".bin")])
 
@@ -275,7 +299,7 @@ class MainFrame(wx.Frame):
 
         hbox = wx.BoxSizer(wx.HORIZONTAL)
 
-        fgs = wx.FlexGridSizer(8, 2, 10, 10)
+        fgs = wx.FlexGridSizer(9, 2, 10, 10)
 
         self.choice = wx.Choice(panel, choices=self._get_serial_ports())
         self.choice.Bind(wx.EVT_CHOICE, on_select_port)
@@ -306,6 +330,12 @@ class MainFrame(wx.Frame):
         logs_button = wx.Button(panel, -1, "View Logs")
         logs_button.Bind(wx.EVT_BUTTON, on_logs_clicked)
 
+        self.progress_gauge = wx.Gauge(panel, range=100)
+        self.progress_label = wx.StaticText(panel, label="")
+        progress_boxsizer = wx.BoxSizer(wx.HORIZONTAL)
+        progress_boxsizer.Add(self.progress_gauge, 1, wx.ALIGN_CENTER_VERTICAL)
+        progress_boxsizer.Add(self.progress_label, 0, wx.ALIGN_CENTER_VERTICAL | wx.LEFT, 10)
+
         self.console_ctrl = wx.TextCtrl(panel, style=wx.TE_MULTILINE | wx.TE_READONLY | wx.HSCROLL)
         self.console_ctrl.SetFont(wx.Font((0, 13), wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
         self.console_ctrl.SetBackgroundColour(wx.BLACK)
@@ -315,6 +345,7 @@ class MainFrame(wx.Frame):
         port_label = wx.StaticText(panel, label="Serial port")
         version_label = wx.StaticText(panel, label="Version")
         file_label = wx.StaticText(panel, label="File")
+        progress_label = wx.StaticText(panel, label="Progress")
 
         console_label = wx.StaticText(panel, label="Console")
 
@@ -339,12 +370,15 @@ class MainFrame(wx.Frame):
                 # View Logs button
                 (wx.StaticText(panel, label="")),
                 (logs_button, 1, wx.EXPAND),
+                # Progress gauge
+                (progress_label, 1, wx.ALIGN_CENTER_VERTICAL),
+                (progress_boxsizer, 1, wx.EXPAND),
                 # Console View (growable)
                 (console_label, 1, wx.EXPAND),
                 (self.console_ctrl, 1, wx.EXPAND),
             ]
         )
-        fgs.AddGrowableRow(5, 1)
+        fgs.AddGrowableRow(6, 1)
         fgs.AddGrowableCol(1, 1)
         # hbox.Add(image_panel)
         hbox.Add(fgs, proportion=2, flag=wx.ALL | wx.EXPAND, border=15)
@@ -355,14 +389,33 @@ class MainFrame(wx.Frame):
 
     def _get_serial_ports(self):
         ports = []
-        for port, _ in list_serial_ports():
-            ports.append(port)
+        for port_info in list_serial_ports():
+            ports.append(port_info.port)
         if not self._port and ports:
             self._port = ports[0]
         if not ports:
             ports.append("")
         return ports
 
+    def on_progress(self, event):
+        """Progress callback for the flashing thread, throttled before it reaches the UI thread."""
+        now = time.time()
+        if now - self._last_progress < PROGRESS_UPDATE_INTERVAL and event.done < event.total:
+            return
+        self._last_progress = now
+        wx.CallAfter(self._update_progress, event)
+
+    def _update_progress(self, event):
+        self.progress_gauge.SetRange(max(event.total, 1))
+        self.progress_gauge.SetValue(min(event.done, event.total))
+        label = "{} {} %".format(PROGRESS_LABELS.get(event.phase, event.phase), 100 * event.done // max(event.total, 1))
+        if event.rate:
+            label += " - {:.1f} kB/s".format(event.rate / 1000)
+        if event.eta is not None and event.done < event.total:
+            label += " - ETA {}:{:02d}".format(*divmod(int(event.eta), 60))
+        self.progress_label.SetLabel(label)
+        self.progress_label.GetParent().Layout()
+
     # Menu methods
     def _on_exit_app(self, event):  # pylint: disable=unused-argument
         self.Close(True)
@@ -1,5 +1,6 @@
 from __future__ import print_function
 
+from collections import namedtuple
 import os
 import sys
 
@@ -7,23 +8,47 @@ import serial
 
 DEVNULL = open(os.devnull, "w")
 
+SerialPortInfo = namedtuple("SerialPortInfo", ["port", "desc", "vid", "pid", "serial_number"])
+
 
 def list_serial_ports():
     # from https://github.com/pyserial/pyserial/blob/master/serial/tools/list_ports.py
     from serial.tools.list_ports import comports
 
     result = []
-    for port, desc, info in comports():
+    for port_info in comports():
+        port, desc, info = port_info
         if not port or "VID:PID" not in info:
             continue
         split_desc = desc.split(" - ")
         if len(split_desc) == 2 and split_desc[0] == split_desc[1]:
             desc = split_desc[0]
-        result.append((port, desc))
-    result.sort()
+        result.append(
+            SerialPortInfo(
+                port,
+                desc,
+                getattr(port_info, "vid", None),
+                getattr(port_info, "pid", None),
+                getattr(port_info, "serial_number", None),
+            )
+        )
+    result.sort(key=lambda x: x.port)
     return result
 
 
+def adapter_key(port):
+    """Return a stable key for the USB adapter behind a serial port, or None if it is unknown."""
+    for port_info in list_serial_ports():
+        if port_info.port != port:
+            continue
+        if port_info.vid is None or port_info.pid is None:
+            return None
+        # Adapters without a serial number (CH340 etc.) can only be told apart by where they are plugged in
+        suffix = port_info.serial_number or port
+        return u"{:04X}:{:04X}:{}".format(port_info.vid, port_info.pid, suffix)
+    return None
+
+
 def prevent_print(func, *args, **kwargs):
     orig_sys_stdout = sys.stdout
     sys.stdout = DEVNULL
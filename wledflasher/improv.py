@@ -0,0 +1,179 @@
+import re
+import time
+
+import serial
+
+from wledflasher.common import WledFlasherError
+
+# https://www.improv-wifi.com/serial/
+IMPROV_HEADER = b"IMPROV"
+IMPROV_VERSION = 1
+
+TYPE_CURRENT_STATE = 0x01
+TYPE_ERROR_STATE = 0x02
+TYPE_RPC = 0x03
+TYPE_RPC_RESULT = 0x04
+PACKET_TYPES = (TYPE_CURRENT_STATE, TYPE_ERROR_STATE, TYPE_RPC, TYPE_RPC_RESULT)
+
+STATE_AUTHORIZATION_REQUIRED = 0x01
+STATE_AUTHORIZED = 0x02
+STATE_PROVISIONING = 0x03
+STATE_PROVISIONED = 0x04
+
+ERROR_NONE = 0x00
+ERRORS = {
+    0x01: "invalid RPC packet",
+    0x02: "unknown RPC command",
+    0x03: "unable to connect",
+    0x04: "not authorized",
+    0xFF: "unknown error",
+}
+
+COMMAND_WIFI_SETTINGS = 0x01
+COMMAND_REQUEST_STATE = 0x02
+COMMAND_REQUEST_INFO = 0x03
+
+STATE_REQUEST_INTERVAL = 1.0
+IP_RE = re.compile(r"(\d{1,3}(?:\.\d{1,3}){3})")
+
+
+class ImprovResult(object):
+    def __init__(self, state, error=None, urls=None, device_info=None):
+        self.state = state
+        self.error = error
+        self.urls = urls or []
+        self.device_info = device_info or []
+
+    @property
+    def success(self):
+        return self.state == STATE_PROVISIONED and self.error is None
+
+    @property
+    def ip_address(self):
+        for url in self.urls:
+            match = IP_RE.search(url)
+            if match is not None:
+                return match.group(1)
+        return None
+
+
+def encode_packet(packet_type, data):
+    packet = IMPROV_HEADER + bytes([IMPROV_VERSION, packet_type, len(data)]) + data
+    return packet + bytes([sum(packet) & 0xFF]) + b"\n"
+
+
+def encode_rpc(command, *strings):
+    data = b""
+    for string in strings:
+        data += bytes([len(string)]) + string
+    return encode_packet(TYPE_RPC, bytes([command, len(data)]) + data)
+
+
+def decode_strings(data):
+    strings = []
+    pos = 0
+    while pos < len(data):
+        length = data[pos]
+        strings.append(data[pos + 1 : pos + 1 + length].decode("utf-8", errors="replace"))
+        pos += 1 + length
+    return strings
+
+
+class ImprovSerial(object):
+    """Improv serial client on an already open port, skipping any log output around the packets."""
+
+    def __init__(self, port):
+        self._port = port
+        self._buffer = b""
+
+    def send(self, packet):
+        self._port.write(packet)
+        self._port.flush()
+
+    def read_packet(self, deadline):
+        """Return the next valid (type, data) packet, or None once the deadline has passed."""
+        while True:
+            start = self._buffer.find(IMPROV_HEADER)
+            if start < 0:
+                # Keep a possible partial header at the end
+                self._buffer = self._buffer[-(len(IMPROV_HEADER) - 1) :]
+            else:
+                self._buffer = self._buffer[start:]
+                if len(self._buffer) >= 9:
+                    if self._buffer[6] != IMPROV_VERSION or self._buffer[7] not in PACKET_TYPES:
+                        # "IMPROV" in the log output, don't wait for a length's worth of bytes after it
+                        self._buffer = self._buffer[len(IMPROV_HEADER) :]
+                        continue
+                    end = 9 + self._buffer[8] + 1
+                    if len(self._buffer) >= end:
+                        packet, self._buffer = self._buffer[:end], self._buffer[end:]
+                        if sum(packet[:-1]) & 0xFF == packet[-1]:
+                            return packet[7], packet[9:-1]
+                        # Not a real packet, look for the next header
+                        self._buffer = packet[len(IMPROV_HEADER) :] + self._buffer
+                        continue
+            if time.time() >= deadline:
+                return None
+            try:
+                self._buffer += self._port.read(max(1, self._port.in_waiting))
+            except serial.SerialException as err:
+                raise WledFlasherError("Serial port closed during Wi-Fi provisioning: {}".format(err))
+
+    def wait_ready(self, timeout):
+        """Poll the state until the device is ready for credentials (or already provisioned)."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            self.send(encode_rpc(COMMAND_REQUEST_STATE))
+            poll_deadline = min(deadline, time.time() + STATE_REQUEST_INTERVAL)
+            while True:
+                packet = self.read_packet(poll_deadline)
+                if packet is None:
+                    break
+                packet_type, data = packet
+                if packet_type == TYPE_CURRENT_STATE and data and data[0] != STATE_AUTHORIZATION_REQUIRED:
+                    return data[0]
+        return None
+
+    def request_info(self, timeout):
+        deadline = time.time() + timeout
+        self.send(encode_rpc(COMMAND_REQUEST_INFO))
+        while True:
+            packet = self.read_packet(deadline)
+            if packet is None:
+                return []
+            packet_type, data = packet
+            if packet_type == TYPE_RPC_RESULT and data and data[0] == COMMAND_REQUEST_INFO:
+                return decode_strings(data[2:])
+
+    def send_wifi_settings(self, ssid, password, timeout):
+        deadline = time.time() + timeout
+        self.send(encode_rpc(COMMAND_WIFI_SETTINGS, ssid.encode("utf-8"), password.encode("utf-8")))
+        state = STATE_PROVISIONING
+        while True:
+            packet = self.read_packet(deadline)
+            if packet is None:
+                return ImprovResult(state, "timeout waiting for the device to connect")
+            packet_type, data = packet
+            if packet_type == TYPE_ERROR_STATE and data and data[0] != ERROR_NONE:
+                return ImprovResult(state, ERRORS.get(data[0], "error 0x{:02X}".format(data[0])))
+            if packet_type == TYPE_CURRENT_STATE and data:
+                state = data[0]
+            elif packet_type == TYPE_RPC_RESULT and data and data[0] == COMMAND_WIFI_SETTINGS:
+                return ImprovResult(STATE_PROVISIONED, urls=decode_strings(data[2:]))
+
+
+def provision_wifi(port, ssid, password, ready_timeout=20, connect_timeout=30):
+    """Send Wi-Fi credentials over Improv serial and wait for the device to report its address."""
+    orig_timeout = port.timeout
+    port.timeout = 0.1
+    try:
+        client = ImprovSerial(port)
+        state = client.wait_ready(ready_timeout)
+        if state is None:
+            return ImprovResult(None, "device did not report an Improv ready state")
+        device_info = client.request_info(STATE_REQUEST_INTERVAL)
+        result = client.send_wifi_settings(ssid, password, connect_timeout)
+        result.device_info = device_info
+        return result
+    finally:
+        port.timeout = orig_timeout
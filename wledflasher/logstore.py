@@ -0,0 +1,93 @@
+import bisect
+import os
+import re
+import struct
+import zlib
+
+from wledflasher.const import LOG_ARCHIVE_DIR
+
+# One index entry per compressed chunk: first timestamp, last timestamp, offset and length in the chunk file
+INDEX_ENTRY = struct.Struct("<ddQI")
+CHUNK_LINES = 1000
+CHUNK_SECONDS = 300
+
+
+def normalize_mac(mac):
+    return re.sub(r"[^0-9A-Fa-f]", "", mac).upper()
+
+
+class LogStore(object):
+    """Append-only archive of one device's log lines, stored as zlib chunks with a sparse time index."""
+
+    def __init__(self, mac, root=LOG_ARCHIVE_DIR):
+        self.path = os.path.join(root, normalize_mac(mac))
+        self._chunk_path = os.path.join(self.path, "chunks.bin")
+        self._index_path = os.path.join(self.path, "index.bin")
+        self._lines = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def append(self, timestamp, line):
+        self._lines.append((timestamp, line))
+        if len(self._lines) >= CHUNK_LINES or timestamp - self._lines[0][0] >= CHUNK_SECONDS:
+            self.flush()
+
+    def flush(self):
+        if not self._lines:
+            return
+        data = zlib.compress(
+            "\n".join("{:.3f}\t{}".format(timestamp, line) for timestamp, line in self._lines).encode("utf-8")
+        )
+        os.makedirs(self.path, exist_ok=True)
+        # The chunk goes in before its index entry, so a crash in between only leaves unreferenced bytes
+        with open(self._chunk_path, "ab") as chunk_file:
+            offset = chunk_file.seek(0, os.SEEK_END)
+            chunk_file.write(data)
+        with open(self._index_path, "ab") as index_file:
+            index_file.write(INDEX_ENTRY.pack(self._lines[0][0], self._lines[-1][0], offset, len(data)))
+        self._lines = []
+
+    def read_index(self):
+        try:
+            with open(self._index_path, "rb") as index_file:
+                data = index_file.read()
+        except (IOError, OSError):
+            return []
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        return [INDEX_ENTRY.unpack_from(data, pos) for pos in range(0, usable, INDEX_ENTRY.size)]
+
+    def query(self, since=None, until=None, pattern=None):
+        """Yield (timestamp, line) in the time range matching pattern, only decompressing overlapping chunks.
+
+        pattern is a regular expression, as a string or already compiled.
+        """
+        index = self.read_index()
+        if not index:
+            return
+        regex = re.compile(pattern) if pattern else None
+        start = 0
+        if since is not None:
+            # Chunks are appended in time order, so the last timestamps are sorted
+            start = bisect.bisect_left([entry[1] for entry in index], since)
+        try:
+            chunk_file = open(self._chunk_path, "rb")
+        except (IOError, OSError):
+            return
+        with chunk_file:
+            for first, _, offset, length in index[start:]:
+                if until is not None and first > until:
+                    break
+                chunk_file.seek(offset)
+                for record in zlib.decompress(chunk_file.read(length)).decode("utf-8").split("\n"):
+                    timestamp, line = record.split("\t", 1)
+                    timestamp = float(timestamp)
+                    if since is not None and timestamp < since:
+                        continue
+                    if until is not None and timestamp > until:
+                        break
+                    if regex is None or regex.search(line):
+                        yield timestamp, line
@@ -1,18 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
+import struct
 from tempfile import NamedTemporaryFile
 
-from github import Github, GitReleaseAsset
+import esptool
+from github import Github, GithubException, GitReleaseAsset
 
-from wledflasher.common import open_downloadable_binary
+from wledflasher.common import WledFlasherError, open_downloadable_binary
+from wledflasher.const import ASSET_INDEX_DIR
 
 github = Github(os.getenv("GITHUB_TOKEN", None))
 
+# Board names used in WLED release asset names, mapped to (chip family, flash size)
+ASSET_BOARDS = {
+    "ESP01": ("ESP8266", "1MB"),
+    "ESP02": ("ESP8266", "2MB"),
+    "ESP8266": ("ESP8266", "4MB"),
+    "ESP32": ("ESP32", "4MB"),
+}
+ESP8266_HEADER_FLASH_SIZES = {0: "512KB", 1: "256KB", 2: "1MB", 3: "2MB", 4: "4MB", 8: "8MB", 9: "16MB"}
+ESP32_HEADER_FLASH_SIZES = {0: "1MB", 1: "2MB", 2: "4MB", 3: "8MB", 4: "16MB"}
+# Asset headers are tiny reads where the round trip dominates, so several run at once
+HEADER_READ_CONNECTIONS = 8
+
+
+class AssetInfo(object):
+    def __init__(self, name, family, flash_size, variant):
+        self.name = name
+        self.family = family
+        self.flash_size = flash_size
+        self.variant = variant
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "family": self.family,
+            "flash_size": self.flash_size,
+            "variant": self.variant,
+        }
+
 
 def get_releases():
     repo = github.get_repo("Aircoookie/WLED")
     return repo.get_releases()
 
 
+def get_release(tag):
+    try:
+        repo = github.get_repo("Aircoookie/WLED")
+        if tag == "latest":
+            return repo.get_latest_release()
+        return repo.get_release(tag)
+    except GithubException as err:
+        raise WledFlasherError("Error while looking up release '{}': {}".format(tag, err))
+
+
 def download_firmware(asset: GitReleaseAsset):
     data = open_downloadable_binary(asset.browser_download_url)
 
@@ -20,3 +63,125 @@ def download_firmware(asset: GitReleaseAsset):
     file.write(data.read())
 
     return file
+
+
+def classify_asset_name(name):
+    """Guess (family, flash size, variant) from a name like WLED_0.11.1_ESP32_Ethernet.bin."""
+    tokens = name[: -len(".bin")].upper().split("_")
+    for i, token in enumerate(tokens):
+        if token in ASSET_BOARDS:
+            family, flash_size = ASSET_BOARDS[token]
+            variant = []
+            for extra in tokens[i + 1 :]:
+                if extra.endswith("MB") and extra[:-2].isdigit():
+                    flash_size = extra
+                else:
+                    variant.append(extra.lower())
+            return family, flash_size, "-".join(variant)
+    return None, None, ""
+
+
+def classify_image_header(header):
+    """Read (family, flash size) from the first bytes of an ESP app image, None for what can't be told."""
+    if len(header) < 8 or header[0] != esptool.ESPLoader.ESP_IMAGE_MAGIC:
+        return None, None
+    entry = struct.unpack("<I", header[4:8])[0]
+    size_code = header[3] >> 4
+    if 0x40100000 <= entry < 0x40110000:
+        return "ESP8266", ESP8266_HEADER_FLASH_SIZES.get(size_code)
+    if 0x40070000 <= entry < 0x400C0000:
+        return "ESP32", ESP32_HEADER_FLASH_SIZES.get(size_code)
+    return None, None
+
+
+def read_asset_header(asset, length=8):
+    import requests
+
+    try:
+        with requests.get(
+            asset.browser_download_url, headers={"Range": "bytes=0-{}".format(length - 1)}, stream=True, timeout=30
+        ) as response:
+            response.raise_for_status()
+            return response.raw.read(length)
+    except requests.exceptions.RequestException as err:
+        raise WledFlasherError("Error while reading header of '{}': {}".format(asset.name, err))
+
+
+def classify_asset(asset):
+    """Return the AssetInfo of a release asset and whether its image header could be read."""
+    family, flash_size, variant = classify_asset_name(asset.name)
+    try:
+        header = read_asset_header(asset)
+    except WledFlasherError as err:
+        print("{}, going by the asset name".format(err))
+        return AssetInfo(asset.name, family, flash_size, variant), False
+    header_family, header_flash_size = classify_image_header(header)
+    # The image header is what the chip will actually see, the name is only a convention
+    return AssetInfo(asset.name, header_family or family, header_flash_size or flash_size, variant), True
+
+
+def load_asset_index(release):
+    path = os.path.join(ASSET_INDEX_DIR, "{}.json".format(release.id))
+    try:
+        with open(path, "r") as index_file:
+            return json.load(index_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def save_asset_index(release, index):
+    path = os.path.join(ASSET_INDEX_DIR, "{}.json".format(release.id))
+    try:
+        os.makedirs(ASSET_INDEX_DIR, exist_ok=True)
+        with open(path, "w") as index_file:
+            json.dump(index, index_file, indent=2, sort_keys=True)
+    except (IOError, OSError):
+        pass
+
+
+def classify_release_assets(release):
+    index = load_asset_index(release)
+    assets = [(asset, "{}:{}".format(asset.id, asset.updated_at)) for asset in release.get_assets()]
+    assets = [(asset, key) for asset, key in assets if asset.name.endswith(".bin")]
+    uncached = [asset for asset, key in assets if key not in index]
+    classified = {}
+    if uncached:
+        with ThreadPoolExecutor(min(HEADER_READ_CONNECTIONS, len(uncached))) as executor:
+            classified = dict(zip((asset.id for asset in uncached), executor.map(classify_asset, uncached)))
+
+    result = []
+    changed = False
+    for asset, key in assets:
+        if key in index:
+            entry = index[key]
+            asset_info = AssetInfo(entry["name"], entry["family"], entry["flash_size"], entry["variant"])
+        else:
+            asset_info, from_header = classified[asset.id]
+            # A guess from the name alone is not remembered, the header is read again next time
+            if from_header:
+                index[key] = asset_info.as_dict()
+                changed = True
+        result.append((asset, asset_info))
+    if changed:
+        save_asset_index(release, index)
+    return result
+
+
+def select_release_asset(release, info, flash_size, variant=""):
+    """Pick the release asset built for the connected chip family that fits its flash."""
+    flash_bytes = esptool.flash_size_bytes(flash_size)
+    candidates = []
+    for asset, asset_info in classify_release_assets(release):
+        if asset_info.family != info.family or asset_info.variant != variant:
+            continue
+        if asset_info.flash_size is None or esptool.flash_size_bytes(asset_info.flash_size) > flash_bytes:
+            continue
+        candidates.append((esptool.flash_size_bytes(asset_info.flash_size), asset.name, asset))
+    if not candidates:
+        raise WledFlasherError(
+            "No asset in release {} matches {} with {} flash{}".format(
+                release.tag_name, info.family, flash_size, " ({})".format(variant) if variant else ""
+            )
+        )
+    # Largest layout that still fits uses the flash best
+    return max(candidates)[2]